@@ -1,29 +1,42 @@
 import argparse
 import datetime
-import fileinput
+import multiprocessing
 import os
 import re
+import requests
 import rpm
 import shutil
 import sys
+import tempfile
 import time
 
+from concurrent.futures import ThreadPoolExecutor
 from distroinfo import info
 from distroinfo import query
-from rdopkg.utils.git import git
 from rdoutils import review_utils
 from rdoutils import releases_utils
 from rdoutils import rdoinfo as rdoinfo_utils
 from rdoutils.rdoinfo import NotInRdoinfoRelease
-from sh import rdopkg, spectool
+from sh import ErrorReturnCode, git, rdopkg
 
-from .utils import log_message
+from . import utils
 
 rdoinfo_repo = ('https://raw.githubusercontent.com/'
                 'redhat-openstack/rdoinfo/master/')
 # From https://releases.openstack.org/#cryptographic-signatures
 current_pubkey_fingerprint = "22284f69d9eccdf3df7819791c711af193ff8e54"
 
+# Seconds to wait for new tarballs to be available, since the start of the
+# run
+TARBALL_DEADLINE = 1200
+# Initial and maximum seconds between checks of pending tarballs
+TARBALL_WAIT = 15
+TARBALL_MAX_WAIT = 240
+TARBALL_REQUEST_TIMEOUT = 30
+TARBALL_WORKERS = 8
+# Flag of sources in rpm spec sources, from rpmbuild RPMBUILD_ISSOURCE
+RPMBUILD_ISSOURCE = 1
+
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Process information about \
@@ -62,49 +75,84 @@ def parse_args():
                         default=None,
                         help='Tag in rdoinfo associated with this release.'
                         'By default the release name')
+    parser.add_argument('--releases-mirror', dest='releases_mirror',
+                        default=None,
+                        help='Path to a local mirror of openstack/releases '
+                        'used to read deliverable files. It is cloned if it '
+                        'does not exist')
+    parser.add_argument('--reference', dest='reference', default=None,
+                        help='Path to a bare git repository used as object '
+                        'store shared by all distgits through git '
+                        'alternates. It is created if it does not exist')
+    parser.add_argument('-j', '--jobs', dest='jobs', default=1, type=int,
+                        help='Number of packages to process in parallel')
+    parser.add_argument('--tarball-deadline', dest='tarball_deadline',
+                        default=TARBALL_DEADLINE, type=int,
+                        help='Seconds to wait for new tarballs to be '
+                        'available, since the start of the run, before '
+                        'sending the reviews anyway')
     return parser.parse_args()
 
 
-def create_dirs(directory):
-    log_message('INFO', "Running rdo_auto_release in %s directory" % directory,
-                logfile, stdout_only=True)
-    dir_list = [directory, datadir, logdir, repodir]
-    for directory in dir_list:
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-
-
-def env_prep(directory, gerrit_user):
-    global datadir
-    datadir = directory + '/data'
-    global logdir
-    logdir = directory + '/logs/'
-    global logfile
-    now = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
-    logfile = "%s%s-rdo-auto-release.log" % (logdir, now)
-    global repodir
-    repodir = datadir + '/distgits'
-    create_dirs(directory)
-    global session
-    global user
-    user = gerrit_user
-    # We need to force TERM variables to invoke rdopkg methods
-    # from library. In some cases as cron or jenkins it's not set
-    # in environment
-    os.environ["TERM"] = "linux"
-    os.environ["TERMINFO"] = '/etc/terminfo'
-
-
-def new_pkgs_review(review, inforepo):
+class ReleaseReviewContext(object):
+    """ Configuration and working directories of rdo_release_review. All
+    the package functions get it as first argument and run commands with
+    the package distgit as explicit working directory.
+    """
+    def __init__(self, directory, user, reference=None):
+        self.directory = directory
+        self.datadir = directory + '/data'
+        self.logdir = directory + '/logs/'
+        now = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+        self.logfile = "%s%s-rdo-auto-release.log" % (self.logdir, now)
+        self.repodir = self.datadir + '/distgits'
+        self.user = user
+        self.reference = reference
+        # When set to a list, log messages are kept in it instead of being
+        # written, so that they can be written later with write_messages.
+        self.message_buffer = None
+
+    def package_dir(self, package):
+        return "%s/%s" % (self.repodir, package)
+
+    def log(self, category, msg, stdout_only=False):
+        log_msg = utils.format_message(category, msg)
+        if self.message_buffer is not None:
+            self.message_buffer.append((log_msg, stdout_only))
+            return
+        utils.write_message(log_msg, self.logfile, stdout_only=stdout_only)
+
+    def write_messages(self, messages):
+        for log_msg, stdout_only in messages:
+            utils.write_message(log_msg, self.logfile,
+                                stdout_only=stdout_only)
+
+    def prepare(self):
+        self.log('INFO', "Running rdo_auto_release in %s directory" %
+                 self.directory, stdout_only=True)
+        dir_list = [self.directory, self.datadir, self.logdir, self.repodir]
+        for directory in dir_list:
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+        if self.reference and not os.path.exists(
+                os.path.join(self.reference, 'objects')):
+            git('init', '--bare', self.reference)
+        # We need to force TERM variables to invoke rdopkg methods
+        # from library. In some cases as cron or jenkins it's not set
+        # in environment
+        os.environ["TERM"] = "linux"
+        os.environ["TERMINFO"] = '/etc/terminfo'
+
+
+def new_pkgs_review(ctx, review, inforepo):
     review_number = review['_number']
-    log_message('INFO', "Processing releases for review %s" % review_number,
-                logfile)
+    ctx.log('INFO', "Processing releases for review %s" % review_number)
     new_pkgs = []
     new_releases = releases_utils.get_new_releases_review(review)
     for release in new_releases:
         for repo in release['repos']:
-            log_message('INFO', "%s Found new repo version %s %s" % (
-                        review_number, repo, release['version']), logfile)
+            ctx.log('INFO', "%s Found new repo version %s %s" % (
+                    review_number, repo, release['version']))
             pkg = query.find_package(inforepo, repo, strict=True)
             if not pkg:
                 # Some openstack packages are special and name in RDO !=
@@ -115,9 +163,8 @@ def new_pkgs_review(review, inforepo):
                     query.find_package(inforepo, repo_url, strict=True) or \
                     query.find_package(inforepo, repo_url_old, strict=True)
             if pkg:
-                log_message('INFO', "%s Found new package %s %s" % (
-                            review_number, pkg['name'], release['version']),
-                            logfile)
+                ctx.log('INFO', "%s Found new package %s %s" % (
+                        review_number, pkg['name'], release['version']))
                 pkg = {'name': pkg['name'],
                        'version': release['version'],
                        'osp_release': release['release']}
@@ -125,10 +172,14 @@ def new_pkgs_review(review, inforepo):
     return new_pkgs
 
 
-def get_evr(package):
-    os.chdir("%s/%s" % (repodir, package))
+def parse_spec(ctx, package):
     tran = rpm.TransactionSet()
-    spec = tran.parseSpec('%s.spec' % package)
+    return tran.parseSpec("{0}/{1}.spec".format(ctx.package_dir(package),
+                                                package))
+
+
+def get_evr(ctx, package):
+    spec = parse_spec(ctx, package)
     hdr = spec.packages[0].header
     e = hdr.format('%{epoch}')
     v = hdr.format('%{version}')
@@ -136,17 +187,82 @@ def get_evr(package):
     return (e, v, r)
 
 
-def clone_distgit(package, release):
-    os.chdir(repodir)
-    if os.path.exists(package):
-        shutil.rmtree(package)
-    rdopkg('clone', package, '-u', user)
-    os.chdir(package)
+def ref_exists(ctx, package, ref):
+    try:
+        git('show-ref', '--verify', '--quiet', ref,
+            _cwd=ctx.package_dir(package))
+        return True
+    except ErrorReturnCode:
+        return False
+
+
+def set_alternates(ctx, package):
+    """ Use the shared object store for objects of the package distgit """
+    alternates = "%s/.git/objects/info/alternates" % ctx.package_dir(package)
+    objects = os.path.abspath(os.path.join(ctx.reference, 'objects'))
+    if os.path.exists(alternates):
+        with open(alternates, 'r') as f:
+            if objects in f.read().splitlines():
+                return
+    with open(alternates, 'a') as f:
+        f.write(objects + '\n')
+
+
+def update_reference(ctx, package):
+    """ Copy new objects of the package distgit to the shared object store,
+    so that they are not downloaded again if the distgit is recloned.
+    """
+    git('--git-dir', ctx.reference, 'fetch', '--quiet',
+        os.path.abspath(ctx.package_dir(package)),
+        '+refs/remotes/*:refs/distgits/%s/*' % package)
+
+
+def update_distgit(ctx, package):
+    """ Update an existing distgit checkout, discarding any local change.
+    Returns False if there is not a usable checkout.
+    """
+    pkg_dir = ctx.package_dir(package)
+    if not os.path.isdir("%s/.git" % pkg_dir):
+        return False
+    try:
+        if ctx.reference:
+            set_alternates(ctx, package)
+        git('reset', '--hard', _cwd=pkg_dir)
+        git('clean', '-ffdx', _cwd=pkg_dir)
+        git('fetch', '--all', '--prune', _cwd=pkg_dir)
+    except Exception as e:
+        ctx.log('WARNING', "Distgit checkout for %s is not usable, "
+                "cloning it again: %s" % (package, e))
+        return False
+    return True
+
+
+def clone_distgit(ctx, package, release):
+    """ Clone the distgit for package, or reuse and update the checkout
+    from a previous run, and checkout the release branch.
+    """
+    pkg_dir = ctx.package_dir(package)
+    if not update_distgit(ctx, package):
+        if os.path.exists(pkg_dir):
+            shutil.rmtree(pkg_dir)
+        if ctx.reference:
+            # Don't download objects already in the shared object store
+            env = os.environ.copy()
+            env['GIT_ALTERNATE_OBJECT_DIRECTORIES'] = os.path.abspath(
+                os.path.join(ctx.reference, 'objects'))
+            rdopkg('clone', package, '-u', ctx.user, _cwd=ctx.repodir,
+                   _env=env)
+            set_alternates(ctx, package)
+        else:
+            rdopkg('clone', package, '-u', ctx.user, _cwd=ctx.repodir)
+    if ctx.reference:
+        update_reference(ctx, package)
     stable_branch = "%s-rdo" % release
-    exist_remote = git.ref_exists('refs/remotes/origin/%s' % stable_branch)
+    exist_remote = ref_exists(ctx, package,
+                              'refs/remotes/origin/%s' % stable_branch)
     if exist_remote:
-        git.create_branch(stable_branch, "origin/%s" % stable_branch)
-        git('checkout', stable_branch)
+        git('checkout', '-B', stable_branch, "origin/%s" % stable_branch,
+            _cwd=pkg_dir)
     else:
         raise NotBranchedPackage("Distgit for %s does not contain branch %s" %
                                  (package, stable_branch))
@@ -163,19 +279,25 @@ def is_string_in_file(file_name, string_to_search):
 
 def replace(file, current_line, new_line):
     """ Replace given line in the file by new line """
-    with fileinput.input(file, inplace=True) as f:
-        for line in f:
-            if current_line in line:
-                line = new_line
-            sys.stdout.write(line)
+    with open(file, 'r') as f:
+        lines = [new_line if current_line in line else line for line in f]
+    fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(file) or '.')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.writelines(lines)
+        shutil.copymode(file, tmp_file)
+        os.replace(tmp_file, file)
+    except Exception:
+        os.unlink(tmp_file)
+        raise
 
 
-def update_pubkey_fingerprint(package):
+def update_pubkey_fingerprint(ctx, package):
     """ Update pubkey fingerprint in .spec file
     This function aims to verify the pubkey fingerprint and update it if
     possible.
     """
-    spec_file = "{0}/{1}/{1}.spec".format(repodir, package)
+    spec_file = "{0}/{1}.spec".format(ctx.package_dir(package), package)
     current_line = "%global sources_gpg_sign 0x"
     wanted_line = "%global sources_gpg_sign 0x{}\n".format(
                   current_pubkey_fingerprint)
@@ -186,23 +308,29 @@ def update_pubkey_fingerprint(package):
         return False
 
 
-def new_version(package, version, release, dry_run=True,
-                chglog_user=None, chglog_email=None):
-    os.chdir("%s/%s" % (repodir, package))
-    stable_branch = "%s-rdo" % release
-    git('reset', '--hard', 'origin/%s' % stable_branch)
-    git('checkout', stable_branch)
+def new_version(ctx, package, version, chglog_user=None, chglog_email=None):
+    """ Commit the new version in the release branch checked out by
+    clone_distgit. Returns the rdopkg output and the new commit.
+    """
+    pkg_dir = ctx.package_dir(package)
     cmd = ['new-version', '-b', '-U', version, '-t']
     if chglog_user:
         cmd = cmd + ['-u', chglog_user]
     if chglog_email:
         cmd = cmd + ['-e', chglog_email]
-    new_vers = rdopkg(*cmd, _err_to_out=True)
-    if update_pubkey_fingerprint(package):
-        git('commit', '-a', '--amend', '--no-edit')
-    if not dry_run:
-        git('review', '-t', '%s-update' % release)
-    return str(new_vers)
+    new_vers = rdopkg(*cmd, _err_to_out=True, _cwd=pkg_dir)
+    if update_pubkey_fingerprint(ctx, package):
+        git('commit', '-a', '--amend', '--no-edit', _cwd=pkg_dir)
+    commit = str(git('rev-parse', 'HEAD', _cwd=pkg_dir)).strip()
+    return str(new_vers), commit
+
+
+def send_review(ctx, package, release, commit):
+    """ Send a commit created by new_version to review """
+    pkg_dir = ctx.package_dir(package)
+    stable_branch = "%s-rdo" % release
+    git('checkout', '-B', stable_branch, commit, _cwd=pkg_dir)
+    git('review', '-t', '%s-update' % release, _cwd=pkg_dir)
 
 
 def new_vers_stderr(msg):
@@ -215,89 +343,287 @@ def is_newer(new_evr, old_evr):
     return comp == 1
 
 
-def tarball_exists(package):
-    os.chdir("%s/%s" % (repodir, package))
-    try:
-        spectool('-g', "%s.spec" % package)
-        return True
-    except Exception:
-        return False
+def get_source0_url(ctx, package):
+    spec = parse_spec(ctx, package)
+    for source, number, flags in spec.sources:
+        if number == 0 and flags & RPMBUILD_ISSOURCE:
+            return source
+    return None
 
 
-def wait_for_tarball(package, retries=40, wait=30):
-    retry = 0
-    while retry < retries:
-        tarball_exist = tarball_exists(package)
-        if tarball_exist:
-            return True
-        else:
-            # Wait for sometime before retrying
-            time.sleep(wait)
-        retry += 1
-    return False
+def tarball_exists(url):
+    """ Check with a HEAD request if a Source0 url is available. Sources
+    which are not urls are always available.
+    """
+    if not url.startswith(('http://', 'https://')):
+        return True
+    try:
+        response = requests.head(url.split('#')[0], allow_redirects=True,
+                                 timeout=TARBALL_REQUEST_TIMEOUT)
+    except requests.exceptions.RequestException:
+        return False
+    return response.status_code == 200
 
 
-def is_release_tag(package, version):
-    os.chdir("%s/%s" % (repodir, package))
-    is_tag = git.ref_exists('refs/tags/%s' % version)
+class TarballWatcher(object):
+    """ Wait for the Source0 tarballs of several packages. All the pending
+    urls are checked together, waiting between checks with exponential
+    backoff, until the deadline in seconds since the watcher was created is
+    reached. New urls are checked on the next call to check, then join the
+    pending ones.
+    """
+    def __init__(self, deadline=TARBALL_DEADLINE, wait=TARBALL_WAIT,
+                 max_wait=TARBALL_MAX_WAIT):
+        now = time.time()
+        self.end = now + deadline
+        self.wait = wait
+        self.max_wait = max_wait
+        self.next_time = now
+        self.pending = []
+        self.new = []
+
+    def add(self, url, item):
+        self.new.append((url, item))
+
+    def next_check(self):
+        """ Return the seconds until the next check is due, or None if
+        there is nothing to check.
+        """
+        if self.new:
+            return 0
+        if not self.pending:
+            return None
+        return max(0, self.next_time - time.time())
+
+    def check(self):
+        """ Check the new urls, and the pending ones if they are due,
+        without waiting. Returns a list of (item, True) for the available
+        tarballs and (item, False) for the ones still missing at the
+        deadline.
+        """
+        now = time.time()
+        due, self.new = self.new, []
+        if not self.pending:
+            self.next_time = min(now + self.wait, self.end)
+        elif now >= self.next_time:
+            due, self.pending = self.pending + due, []
+            self.next_time = min(now + self.wait, self.end)
+            self.wait = min(self.wait * 2, self.max_wait)
+        if not due:
+            return []
+        with ThreadPoolExecutor(TARBALL_WORKERS) as executor:
+            available = list(executor.map(tarball_exists,
+                                          [url for url, _ in due]))
+        pending = self.pending
+        done = []
+        for entry, ready in zip(due, available):
+            if ready or now >= self.end:
+                done.append((entry[1], ready))
+            else:
+                pending.append(entry)
+        self.pending = pending
+        return done
+
+
+def is_release_tag(ctx, package, version):
+    is_tag = ref_exists(ctx, package, 'refs/tags/%s' % version)
     return is_tag
 
 
-def process_package(name, version, osp_release, dry_run, check_tag=False,
-                    check_tarball=False, chglog_user=None, chglog_email=None,
-                    rdoinfo_tag=None):
-    log_message('INFO', "Processing package %s version %s for release %s" %
-                (name, version, osp_release), logfile)
+def prepare_package(ctx, name, version, osp_release, check_tag=False,
+                    chglog_user=None, chglog_email=None, rdoinfo_tag=None):
+    """ Prepare the new version of a package in its distgit if needed.
+    Returns a short description of the result and, if it is "prepared", a
+    dictionary with the new commit to send with submit_package and the
+    Source0 url of the new version.
+    """
+    ctx.log('INFO', "Processing package %s version %s for release %s" %
+            (name, version, osp_release))
     if rdoinfo_tag is None:
         rdoinfo_tag = osp_release
     try:
         rdoinfo_pin = rdoinfo_utils.get_pin(name, rdoinfo_tag)
         if rdoinfo_pin and rdoinfo_pin != version:
-            log_message('INFO', "Package %s pinned to version %s in rdoinfo" %
-                        (name, rdoinfo_pin), logfile)
-            return
-        clone_distgit(name, osp_release)
-        if check_tag and not is_release_tag(name, version):
-            log_message('INFO', "Package %s has not release tag %s" %
-                        (name, version), logfile)
-            return
-        old_evr = get_evr(name)
-        new_vers = new_version(name, version, osp_release, dry_run=True,
-                               chglog_user=chglog_user,
-                               chglog_email=chglog_email)
+            ctx.log('INFO', "Package %s pinned to version %s in rdoinfo" %
+                    (name, rdoinfo_pin))
+            return "pinned to %s" % rdoinfo_pin, None
+        clone_distgit(ctx, name, osp_release)
+        if check_tag and not is_release_tag(ctx, name, version):
+            ctx.log('INFO', "Package %s has not release tag %s" %
+                    (name, version))
+            return "no release tag", None
+        old_evr = get_evr(ctx, name)
+        new_vers, commit = new_version(ctx, name, version,
+                                       chglog_user=chglog_user,
+                                       chglog_email=chglog_email)
         if new_vers_stderr(new_vers):
-            log_message('INFO', new_vers_stderr(new_vers).group(1),
-                        logfile)
-        new_evr = get_evr(name)
+            ctx.log('INFO', new_vers_stderr(new_vers).group(1))
+        new_evr = get_evr(ctx, name)
         if not is_newer(new_evr, old_evr):
-            log_message('INFO', "Version %s is not newer that existing %s" %
-                        (new_evr, old_evr), logfile)
-            return
-        if check_tarball and not wait_for_tarball(name):
-            tag_exists = is_release_tag(name, version)
-            log_message('INFO', "Tarball for %s %s is not ready yet, "
-                        "Tag exists: %s" %
-                        (name, version, tag_exists), logfile)
-        log_message('INFO', "Sending review for package %s version %s" %
-                    (name, version), logfile)
-        new_version(name, version, osp_release, dry_run=dry_run,
-                    chglog_user=chglog_user, chglog_email=chglog_email)
-        if dry_run:
-            log_message('INFO', "Running in dry-run mode. Review is not sent",
-                        logfile)
+            ctx.log('INFO', "Version %s is not newer that existing %s" %
+                    (new_evr, old_evr))
+            return "not newer", None
+        return "prepared", {'commit': commit,
+                            'source_url': get_source0_url(ctx, name)}
     except NotBranchedPackage as e:
-        log_message('INFO', "Package %s %s for %s is not required: %s" %
-                    (name, version, osp_release, e), logfile)
+        ctx.log('INFO', "Package %s %s for %s is not required: %s" %
+                (name, version, osp_release, e))
+        return "not branched", None
     except NotInRdoinfoRelease:
-        log_message('INFO', "Package %s is not in release %s" % (name,
-                    osp_release), logfile)
+        ctx.log('INFO', "Package %s is not in release %s" % (name,
+                osp_release))
+        return "not in release", None
     except Exception as e:
-        log_message('ERROR', "Package %s %s for %s failed to build: %s" %
-                    (name, version, osp_release, e), logfile)
+        ctx.log('ERROR', "Package %s %s for %s failed to build: %s" %
+                (name, version, osp_release, e))
         raise e
 
 
-def process_reviews(args):
+def submit_package(ctx, name, version, osp_release, commit, dry_run):
+    """ Send the review for the commit of a package prepared with
+    prepare_package. Returns a short description of the result.
+    """
+    ctx.log('INFO', "Sending review for package %s version %s" %
+            (name, version))
+    if dry_run:
+        ctx.log('INFO', "Running in dry-run mode. Review is not sent")
+        return "dry-run"
+    try:
+        send_review(ctx, name, osp_release, commit)
+    except Exception as e:
+        ctx.log('ERROR', "Package %s %s for %s failed to build: %s" %
+                (name, version, osp_release, e))
+        return "failed"
+    return "review sent"
+
+
+def prepare_package_versions(ctx, pkgs, kwargs):
+    results = []
+    for pkg in pkgs:
+        try:
+            result, prepared = prepare_package(
+                ctx, pkg['name'], pkg['version'], pkg['osp_release'],
+                **kwargs)
+        except Exception:
+            result, prepared = "failed", None
+        results.append((pkg, result, prepared))
+    return results
+
+
+def _worker_prepare_package_versions(worker_args):
+    ctx, pkgs, kwargs = worker_args
+    # The context is a copy owned by this task, its messages are written
+    # by the parent process
+    ctx.message_buffer = []
+    results = prepare_package_versions(ctx, pkgs, kwargs)
+    return results, ctx.message_buffer
+
+
+def print_summary(ctx, results):
+    rows = [('Package', 'Version', 'Release', 'Result')]
+    rows.extend([(pkg['name'], pkg['version'], pkg['osp_release'], result)
+                 for pkg, result in results])
+    widths = [max(len(row[i]) for row in rows) for i in range(3)]
+    ctx.log('INFO', "Summary of processed packages:")
+    for row in rows:
+        ctx.log('INFO', "%s  %s  %s  %s" % (row[0].ljust(widths[0]),
+                                            row[1].ljust(widths[1]),
+                                            row[2].ljust(widths[2]),
+                                            row[3]))
+
+
+def process_packages(ctx, pkgs, jobs=1, dry_run=False, check_tag=False,
+                     check_tarball=False, chglog_user=None,
+                     chglog_email=None, rdoinfo_tag=None,
+                     tarball_deadline=TARBALL_DEADLINE):
+    """ Send reviews for a list of new package versions.
+
+    New versions are prepared in a pool of jobs forked processes if
+    jobs > 1. Versions of a package are prepared in order by the same worker
+    as they share the distgit checkout, and logs are written in the order
+    of the list once all versions of each package are prepared.
+
+    The review of each package is sent as soon as it is prepared. If
+    check_tarball is True, it's sent once the Source0 tarball is available,
+    or when tarball_deadline seconds passed since the start of the run,
+    tarballs being checked while the next packages are prepared. Returns a
+    list of (pkg, result).
+    """
+    by_name = {}
+    for pkg in pkgs:
+        by_name.setdefault(pkg['name'], []).append(pkg)
+    prepare_kwargs = {'check_tag': check_tag,
+                      'chglog_user': chglog_user,
+                      'chglog_email': chglog_email,
+                      'rdoinfo_tag': rdoinfo_tag}
+    prepared = []
+    results = []
+    watcher = TarballWatcher(deadline=tarball_deadline)
+
+    def submit(i):
+        pkg, _, pkg_prepared = prepared[i]
+        results[i] = submit_package(ctx, pkg['name'], pkg['version'],
+                                    pkg['osp_release'],
+                                    pkg_prepared['commit'], dry_run)
+
+    def submit_ready():
+        for i, available in watcher.check():
+            if not available:
+                pkg = prepared[i][0]
+                tag_exists = is_release_tag(ctx, pkg['name'], pkg['version'])
+                ctx.log('INFO', "Tarball for %s %s is not ready yet, "
+                        "Tag exists: %s" %
+                        (pkg['name'], pkg['version'], tag_exists))
+            submit(i)
+
+    def add_prepared(pkg_results):
+        for pkg, result, pkg_prepared in pkg_results:
+            i = len(prepared)
+            prepared.append((pkg, result, pkg_prepared))
+            results.append(result)
+            if result != "prepared":
+                continue
+            # Reviews are not sent in dry-run mode, no need to wait
+            if check_tarball and not dry_run and pkg_prepared['source_url']:
+                watcher.add(pkg_prepared['source_url'], i)
+            else:
+                submit(i)
+        submit_ready()
+
+    if jobs > 1 and len(by_name) > 1:
+        worker_args = [(ctx, name_pkgs, prepare_kwargs)
+                       for name_pkgs in by_name.values()]
+        mp_ctx = multiprocessing.get_context('fork')
+        with mp_ctx.Pool(min(jobs, len(by_name))) as pool:
+            prepared_iter = pool.imap(_worker_prepare_package_versions,
+                                      worker_args)
+            while True:
+                try:
+                    pkg_results, messages = prepared_iter.next(
+                        watcher.next_check())
+                except multiprocessing.TimeoutError:
+                    # Check the tarballs while packages are prepared
+                    submit_ready()
+                    continue
+                except StopIteration:
+                    break
+                ctx.write_messages(messages)
+                add_prepared(pkg_results)
+    else:
+        for name_pkgs in by_name.values():
+            add_prepared(prepare_package_versions(ctx, name_pkgs,
+                                                  prepare_kwargs))
+
+    while watcher.next_check() is not None:
+        time.sleep(watcher.next_check())
+        submit_ready()
+    results = [(entry[0], result) for entry, result in zip(prepared, results)]
+    if results:
+        print_summary(ctx, results)
+    return results
+
+
+def process_reviews(ctx, args):
     distroinfo = info.DistroInfo(
         info_files='rdo.yml',
         remote_info=rdoinfo_repo)
@@ -307,48 +633,59 @@ def process_reviews(args):
     else:
         after = datetime.datetime.now() - datetime.timedelta(days=args.days)
         after_fmt = after.strftime('%Y-%m-%d')
-    reviews = review_utils.get_osp_releases_reviews(args.release,
-                                                    after=after_fmt,
-                                                    number=args.number,
-                                                    status='merged')
+    reviews = review_utils.iter_osp_releases_reviews(args.release,
+                                                     after=after_fmt,
+                                                     number=args.number,
+                                                     status='merged')
+    pkgs = []
     for review in reviews:
         rev_num = review['_number']
-        log_message('INFO', "Processing review %s" % rev_num, logfile)
-        new_pkgs = new_pkgs_review(review, inforepo)
-        for new_pkg in new_pkgs:
-            if new_pkg['osp_release'] == args.release:
-                process_package(new_pkg['name'], new_pkg['version'],
-                                new_pkg['osp_release'], args.dry_run,
-                                check_tarball=True,
-                                chglog_user=args.changelog_user,
-                                chglog_email=args.changelog_email,
-                                rdoinfo_tag=args.rdoinfo_tag)
-
-
-def process_rdoinfo(args):
+        ctx.log('INFO', "Processing review %s" % rev_num)
+        new_pkgs = new_pkgs_review(ctx, review, inforepo)
+        pkgs.extend([new_pkg for new_pkg in new_pkgs
+                     if new_pkg['osp_release'] == args.release])
+    return process_packages(ctx, pkgs, jobs=args.jobs,
+                            dry_run=args.dry_run, check_tarball=True,
+                            tarball_deadline=args.tarball_deadline,
+                            chglog_user=args.changelog_user,
+                            chglog_email=args.changelog_email,
+                            rdoinfo_tag=args.rdoinfo_tag)
+
+
+def process_rdoinfo(ctx, args):
     if args.rdoinfo_tag is None:
         rdoinfo_tag = args.release
     else:
         rdoinfo_tag = args.rdoinfo_tag
     new_pins = rdoinfo_utils.get_new_pinned_builds(args.rdoinfo_pins,
                                                    rdoinfo_tag)
+    pkgs = []
     for pin in new_pins:
-        log_message('INFO', "rdoinfo Found new package %s %s %s" % (
-                    pin['name'], pin['version'], pin['release']), logfile)
-        process_package(pin['name'], pin['version'], args.release,
-                        args.dry_run, check_tag=True,
-                        chglog_user=args.changelog_user,
-                        chglog_email=args.changelog_email,
-                        rdoinfo_tag=rdoinfo_tag)
+        ctx.log('INFO', "rdoinfo Found new package %s %s %s" % (
+                pin['name'], pin['version'], pin['release']))
+        pkgs.append({'name': pin['name'],
+                     'version': pin['version'],
+                     'osp_release': args.release})
+    return process_packages(ctx, pkgs, jobs=args.jobs,
+                            dry_run=args.dry_run, check_tag=True,
+                            chglog_user=args.changelog_user,
+                            chglog_email=args.changelog_email,
+                            rdoinfo_tag=rdoinfo_tag)
 
 
 def main():
     args = parse_args()
-    env_prep(args.directory, args.user)
+    ctx = ReleaseReviewContext(args.directory, args.user,
+                               reference=args.reference)
+    ctx.prepare()
+    if args.releases_mirror:
+        releases_utils.set_releases_mirror(args.releases_mirror)
     if args.rdoinfo_pins:
-        process_rdoinfo(args)
+        results = process_rdoinfo(ctx, args)
     else:
-        process_reviews(args)
+        results = process_reviews(ctx, args)
+    if any(result == "failed" for _, result in results):
+        sys.exit(1)
 
 
 class NotBranchedPackage(Exception):
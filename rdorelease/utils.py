@@ -7,10 +7,13 @@ def review_time_fmt(time):
     return time_obj.strftime("%s")
 
 
-def log_message(category, msg, logfile, stdout_only=False):
+def format_message(category, msg):
     now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    log_msg = "%s - %s: %s" % (now, category, msg)
+    return "%s - %s: %s" % (now, category, msg)
+
+
+def write_message(log_msg, logfile, stdout_only=False):
     print(log_msg)
     if not stdout_only:
-        f = open(logfile, 'a+')
-        f.write(log_msg + '\n')
+        with open(logfile, 'a+') as f:
+            f.write(log_msg + '\n')
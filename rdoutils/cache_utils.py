@@ -0,0 +1,86 @@
+import hashlib
+import json
+import os
+import requests
+
+# Root directory of the on-disk caches of rdoutils. Set RDOUTILS_CACHE_DIR
+# to an empty value to disable them.
+cache_root = os.environ.get('RDOUTILS_CACHE_DIR',
+                            os.environ['HOME'] + '/.cache/rdoutils')
+
+# Seconds to wait for the server in downloads
+HTTP_TIMEOUT = 60
+
+
+def get_cache_dir(name):
+    """ Return the directory of the cache called name, or None if on-disk
+    caches are disabled.
+    """
+    if not cache_root:
+        return None
+    return os.path.join(cache_root, name)
+
+
+def _cache_files(url, cache_dir):
+    name = hashlib.sha1(url.encode('utf-8')).hexdigest()
+    return (os.path.join(cache_dir, name + '.data'),
+            os.path.join(cache_dir, name + '.json'))
+
+
+def read_cached(url, cache_dir):
+    """ Return the content of url kept in cache_dir and its metadata, or
+    (None, {}) if it is not in the cache.
+    """
+    if not cache_dir:
+        return None, {}
+    data_file, meta_file = _cache_files(url, cache_dir)
+    try:
+        with open(data_file, 'r') as infile:
+            content = infile.read()
+        with open(meta_file, 'r') as infile:
+            meta = json.load(infile)
+    except (IOError, ValueError):
+        return None, {}
+    if meta.get('url') != url:
+        return None, {}
+    return content, meta
+
+
+def _write_cached(url, cache_dir, content, meta):
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    data_file, meta_file = _cache_files(url, cache_dir)
+    with open(data_file, 'w') as outfile:
+        outfile.write(content)
+    with open(meta_file, 'w') as outfile:
+        json.dump(meta, outfile)
+
+
+def cached_download(url, cache_dir, session=requests, timeout=HTTP_TIMEOUT):
+    """ Download url, keeping the content in cache_dir with its ETag and
+    Last-Modified headers, so that it's only downloaded again when the
+    server reports it has been modified.
+
+    Returns the status code of the response and the content, which is the
+    cached one when the server returns 304, or None when the status is not
+    200 or 304. Request errors are raised. The cache is not used if
+    cache_dir is None.
+    """
+    content, meta = read_cached(url, cache_dir)
+    headers = {}
+    if content is not None:
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last-modified'):
+            headers['If-Modified-Since'] = meta['last-modified']
+    result = session.get(url, headers=headers, timeout=timeout)
+    if result.status_code == 304 and content is not None:
+        return result.status_code, content
+    if result.status_code != 200:
+        return result.status_code, None
+    if cache_dir:
+        _write_cached(url, cache_dir, result.text,
+                      {'url': url,
+                       'etag': result.headers.get('ETag'),
+                       'last-modified': result.headers.get('Last-Modified')})
+    return result.status_code, result.text
@@ -1,18 +1,146 @@
+import json
 import koji
+import os
+import tempfile
+
+from rdoutils import cache_utils
+from urllib.parse import urlparse
 
 # From https://cbs.centos.org/koji/api
 CBS_KOJI_URL = "https://cbs.centos.org/kojihub"
 
+# Directory used to keep the builds tagged in koji tags
+cache_dir = cache_utils.get_cache_dir('koji')
+
+# Builds tagged by (hub url, tag), each entry is a dictionary with the
+# event id the builds list was refreshed to and the builds.
+all_tagged = {}
+
+# Fields kept for each tagged build
+BUILD_FIELDS = ['build_id', 'name', 'package_name', 'version', 'release',
+                'epoch', 'nvr', 'tag_name', 'create_event']
+
 
 def get_cbs_client():
     return koji.ClientSession(CBS_KOJI_URL)
 
 
-def list_pkg_names_tagged_in(koji_tag):
-    client = get_cbs_client()
-    tagged_pkgs = client.listTagged(koji_tag)
+def _cache_file(hub_url, koji_tag):
+    return os.path.join(cache_dir, "%s-%s.json" %
+                        (urlparse(hub_url).netloc, koji_tag))
+
+
+def _read_cache(hub_url, koji_tag):
+    if not cache_dir:
+        return None
+    try:
+        with open(_cache_file(hub_url, koji_tag), 'r') as infile:
+            return json.load(infile)
+    except (IOError, ValueError):
+        return None
+
+
+def _write_cache(hub_url, koji_tag, tagged):
+    if not cache_dir:
+        return
+    try:
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        # Write a new file and rename it, so that other processes never
+        # read a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as outfile:
+                json.dump(tagged, outfile)
+            os.replace(tmp_path, _cache_file(hub_url, koji_tag))
+        except OSError:
+            os.unlink(tmp_path)
+            raise
+    except OSError:
+        # The cache is an optimization, never fail because of it
+        pass
+
 
+def _list_tagged_full(client, koji_tag, event_id):
+    builds = client.listTagged(koji_tag, event=event_id)
+    return [{k: build.get(k) for k in BUILD_FIELDS} for build in builds]
+
+
+def _apply_history(builds, history, koji_tag, event_id):
+    """ Apply tag_listing history entries newer than event_id to a list of
+    tagged builds. Returns the new list sorted by tagging event, newest
+    first, as listTagged does.
+    """
+    changes = []
+    for entry in history:
+        if entry['create_event'] > event_id:
+            changes.append((entry['create_event'], True, entry))
+        if entry['revoke_event'] and entry['revoke_event'] > event_id:
+            changes.append((entry['revoke_event'], False, entry))
+    by_id = {build['build_id']: build for build in builds}
+    for _, tagged, entry in sorted(changes, key=lambda c: c[0]):
+        if not tagged:
+            by_id.pop(entry['build_id'], None)
+            continue
+        name = entry['package.name']
+        version = entry['build.version']
+        release = entry['build.release']
+        by_id[entry['build_id']] = {
+            'build_id': entry['build_id'],
+            'name': name,
+            'package_name': name,
+            'version': version,
+            'release': release,
+            'epoch': entry['build.epoch'],
+            'nvr': "%s-%s-%s" % (name, version, release),
+            'tag_name': koji_tag,
+            'create_event': entry['create_event'],
+        }
+    return sorted(by_id.values(), key=lambda b: b['create_event'],
+                  reverse=True)
+
+
+def list_tagged(koji_tag, client=None):
+    """ Return the builds tagged in koji_tag, as listTagged.
+
+    Results are kept in cache_dir with the koji event id they were taken
+    at. On next calls only the tag history after that event is queried and
+    applied, unless no event happened at all in the hub.
+    """
+    if client is None:
+        client = get_cbs_client()
+    hub_url = client.baseurl
+    key = (hub_url, koji_tag)
+    tagged = all_tagged.get(key) or _read_cache(hub_url, koji_tag)
+    last_event = client.getLastEvent()['id']
+    if tagged and tagged['event_id'] == last_event:
+        all_tagged[key] = tagged
+        return tagged['builds']
+
+    builds = None
+    if tagged:
+        try:
+            history = client.queryHistory(tables=['tag_listing'],
+                                          tag=koji_tag,
+                                          afterEvent=tagged['event_id'],
+                                          beforeEvent=last_event + 1)
+            builds = _apply_history(tagged['builds'],
+                                    history['tag_listing'], koji_tag,
+                                    tagged['event_id'])
+        except (koji.GenericError, KeyError):
+            # Fall back to list the whole tag if the hub doesn't provide
+            # the expected history
+            builds = None
+    if builds is None:
+        builds = _list_tagged_full(client, koji_tag, last_event)
+    tagged = {'event_id': last_event, 'builds': builds}
+    all_tagged[key] = tagged
+    _write_cache(hub_url, koji_tag, tagged)
+    return builds
+
+
+def list_pkg_names_tagged_in(koji_tag):
     pkg_names = []
-    for pkg in tagged_pkgs:
+    for pkg in list_tagged(koji_tag):
         pkg_names.append(pkg['package_name'])
     return pkg_names
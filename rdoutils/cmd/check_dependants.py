@@ -14,49 +14,127 @@
 
 from collections import OrderedDict
 import argparse
+import configparser
+import csv
+import fnmatch
+import json
+import multiprocessing
 import os
 import sys
+import time
 
 import dnf
+import dnf.exceptions
+import dnf.repo
+import yaml
 
+from rdoutils import cache_utils
 
-def get_repos(release):
-    RDO_TRUNK_C8 = {
-        "rdo-baremetal": "http://trunk.rdoproject.org/centos8-%s/component/baremetal/current" % release, # noqa
-        "rdo-cinder": "http://trunk.rdoproject.org/centos8-%s/component/cinder/current" % release, # noqa
-        "rdo-clients": "http://trunk.rdoproject.org/centos8-%s/component/clients/current" % release, # noqa
-        "rdo-cloudops": "http://trunk.rdoproject.org/centos8-%s/component/cloudops/current" % release, # noqa
-        "rdo-common": "http://trunk.rdoproject.org/centos8-%s/component/common/current" % release, # noqa
-        "rdo-compute": "http://trunk.rdoproject.org/centos8-%s/component/compute/current" % release, # noqa
-        "rdo-glance": "http://trunk.rdoproject.org/centos8-%s/component/glance/current" % release, # noqa
-        "rdo-manila": "http://trunk.rdoproject.org/centos8-%s/component/manila/current" % release, # noqa
-        "rdo-network": "http://trunk.rdoproject.org/centos8-%s/component/network/current" % release, # noqa
-        "rdo-octavia": "http://trunk.rdoproject.org/centos8-%s/component/octavia/current" % release, # noqa
-        "rdo-security": "http://trunk.rdoproject.org/centos8-%s/component/security/current" % release, # noqa
-        "rdo-swift": "http://trunk.rdoproject.org/centos8-%s/component/swift/current" % release, # noqa
-        "rdo-tempest": "http://trunk.rdoproject.org/centos8-%s/component/tempest/current" % release, # noqa
-        "rdo-tripleo": "http://trunk.rdoproject.org/centos8-%s/component/tripleo/current" % release, # noqa
-        "rdo-ui": "http://trunk.rdoproject.org/centos8-%s/component/ui/current" % release, # noqa
-        "rdo-component": "http://trunk.rdoproject.org/centos8-%s/component/validation/current" % release, # noqa
-        "deps": "http://trunk.rdoproject.org/centos8-%s/deps/latest" % release, # noqa
-        "build-deps": "http://trunk.rdoproject.org/centos8-%s/build-deps/latest" % release, # noqa
-        "deps-srpm": "http://trunk.rdoproject.org/centos8-%s/deps/latest/SRPMS" % release, # noqa
-        "build-srpm": "http://trunk.rdoproject.org/centos8-%s/build-deps/latest/SRPMS" % release, # noqa
+
+RDO_COMPONENTS = ["baremetal", "cinder", "clients", "cloudops", "common",
+                  "compute", "glance", "manila", "network", "octavia",
+                  "security", "swift", "tempest", "tripleo", "ui",
+                  "validation"]
+
+
+def rdo_trunk_repos(distro):
+    """ Return the RDO Trunk repos for a distro, with {release} to be
+        replaced by the release name.
+    """
+    trunk = "https://trunk.rdoproject.org/%s-{release}" % distro
+    repos = {}
+    for component in RDO_COMPONENTS:
+        repos["rdo-%s" % component] = "%s/component/%s/current" % (trunk,
+                                                                   component)
+    repos.update({
+        "deps": "%s/deps/latest" % trunk,
+        "build-deps": "%s/build-deps/latest" % trunk,
+        "deps-srpm": "%s/deps/latest/SRPMS" % trunk,
+        "build-srpm": "%s/build-deps/latest/SRPMS" % trunk,
+    })
+    return repos
+
+
+def centos_stream_repos(version):
+    mirror = "https://mirror.stream.centos.org/%s-stream" % version
+    return {
+        "baseos": "%s/BaseOS/x86_64/os/" % mirror,
+        "appstream": "%s/AppStream/x86_64/os/" % mirror,
+        "crb": "%s/CRB/x86_64/os/" % mirror,
+        "baseos-srpm": "%s/BaseOS/source/tree/" % mirror,
+        "appstream-srpm": "%s/AppStream/source/tree/" % mirror,
+        "crb-srpm": "%s/CRB/source/tree/" % mirror,
+    }
+
+
+# Repos by distro, {release} is replaced by the release name
+DISTRO_REPOS = {
+    "centos8": dict(rdo_trunk_repos("centos8"), **{
         "baseos": "http://mirror.centos.org/centos/8-stream/BaseOS/x86_64/os/", # noqa
         "appstream": "http://mirror.centos.org/centos/8-stream/AppStream/x86_64/os/", # noqa
         "baseos-srpm": "https://vault.centos.org/centos/8-stream/BaseOS/Source/", # noqa
         "appstream-srpm": "https://vault.centos.org/centos/8-stream/AppStream/Source/", # noqa
-    }
-
-    releases = {
-        "master": RDO_TRUNK_C8,
-        "wallaby": RDO_TRUNK_C8,
-        "victoria": RDO_TRUNK_C8,
-        "ussuri": RDO_TRUNK_C8,
-        "train": RDO_TRUNK_C8,
-    }
-
-    return releases[release]
+    }),
+    "centos9": dict(rdo_trunk_repos("centos9"), **centos_stream_repos(9)),
+    "centos10": dict(rdo_trunk_repos("centos10"), **centos_stream_repos(10)),
+}
+DEFAULT_DISTRO = "centos9"
+ARCH = "x86_64"
+
+
+def load_repos_config(config_file, distro=DEFAULT_DISTRO):
+    """ Load repos definitions from a file, either a .repo file with a
+        baseurl per section or a yaml file with a dict of repos by distro:
+
+        centos9:
+          rdo-common: https://trunk.rdoproject.org/centos9-{release}/...
+          local: file:///srv/repos/local
+
+        {release} is replaced by the release name. Returns a dict in the
+        same format as DISTRO_REPOS. The repos in a .repo file are used for
+        distro, skipping the disabled ones, and $releasever and $basearch
+        are replaced by the distro version and x86_64.
+    """
+    if config_file.endswith('.repo'):
+        parser = configparser.ConfigParser(interpolation=None)
+        parser.read(config_file)
+        releasever = ''.join(c for c in distro if c.isdigit())
+        repos = {}
+        for section in parser.sections():
+            if not parser.has_option(section, 'baseurl'):
+                continue
+            if not parser.getboolean(section, 'enabled', fallback=True):
+                continue
+            baseurl = parser.get(section, 'baseurl').split()[0]
+            repos[section] = baseurl.replace(
+                '$releasever', releasever).replace('$basearch', ARCH)
+        return {distro: repos}
+    with open(config_file, 'r') as f:
+        return yaml.safe_load(f)
+
+
+def get_repos(release, distro=DEFAULT_DISTRO, repos_config=None,
+              only_repos=None):
+    """ Return a dict {repo name: baseurl} for a release and distro.
+
+        :param repos_config: dict of repos by distro, as returned by
+            load_repos_config, DISTRO_REPOS is used if None
+        :param only_repos: list of repo names or shell patterns, i.e.
+            rdo-c*, to load only a subset of the repos
+    """
+    if repos_config is None:
+        repos_config = DISTRO_REPOS
+    try:
+        templates = repos_config[distro]
+    except KeyError:
+        raise ValueError("No repos defined for distro %s" % distro)
+    repos = {}
+    for name, url in templates.items():
+        if only_repos and not any(fnmatch.fnmatch(name, pattern)
+                                  for pattern in only_repos):
+            continue
+        repos[name] = url.replace('{release}', release)
+    return repos
 
 
 def eprint(*args, **kwargs):
@@ -65,13 +143,30 @@ def eprint(*args, **kwargs):
     print(*args, **kwargs)
 
 
-def setup_dnf(release="wallaby"):
+# Persistent cache of repositories metadata and solv files, dnf default
+# cache is used if RDOUTILS_CACHE_DIR is empty
+DNF_CACHEDIR = cache_utils.get_cache_dir('dnf')
+# Seconds before checking again if cached repositories metadata changed
+METADATA_EXPIRE = 6 * 3600
+
+
+def setup_dnf(release="wallaby", cachedir=DNF_CACHEDIR,
+              metadata_expire=METADATA_EXPIRE, offline=False, repos=None):
     """ Setup dnf query with two repos
+
+        Repositories metadata is kept in ``cachedir``. When it's older than
+        ``metadata_expire`` seconds, dnf checks repomd.xml and only
+        downloads metadata again if it changed. If ``offline`` is True,
+        the sack is created only from cached metadata. ``repos`` is a dict
+        {repo name: baseurl}, get_repos(release) by default.
     """
-    repos = get_repos(release)
+    if repos is None:
+        repos = get_repos(release)
     base = dnf.Base()
     # use digest to make repo id unique for each URL
     conf = base.conf
+    if cachedir:
+        conf.cachedir = cachedir
     for name in repos.keys():
         r = base.repos.add_new_repo(
             ("repo-%s" % name),
@@ -79,29 +174,177 @@ def setup_dnf(release="wallaby"):
             baseurl=[repos[name]],
             skip_if_unavailable=False,
             gpgcheck=0,
+            metadata_expire=str(metadata_expire),
         )
+        if offline:
+            # Same as dnf --cacheonly
+            r._repo.setSyncStrategy(dnf.repo.SYNC_ONLY_CACHE)
         r.enable()
-        r.load()
+        try:
+            r.load()
+        except dnf.exceptions.RepoError as e:
+            if offline:
+                eprint("No cached metadata for repo %s in offline mode: %s" %
+                       (name, e))
+                sys.exit(1)
+            raise
 
     base.fill_sack(load_system_repo=False, load_available_repos=True)
     return base.sack.query()
 
 
+# Words and operators which are not package names in rich dependencies
+RICH_DEP_KEYWORDS = {'and', 'or', 'if', 'else', 'with', 'without', 'unless'}
+RICH_DEP_OPERATORS = {'=', '<', '>', '<=', '>=', '=='}
+
+
+def rich_dep_tokens(dep):
+    """ Split a rich dependency in tokens. Parentheses of the boolean
+    expression are separate tokens, but the ones after a name are kept with
+    it, i.e. "(python3dist(foo) >= 1 or bar)" ->
+    ["(", "python3dist(foo)", ">=", "1", "or", "bar", ")"]
+    """
+    tokens = []
+    token = ''
+    depth = 0
+    for c in dep:
+        if depth:
+            # inside the parentheses of a name, i.e. python3dist(...)
+            token += c
+            if c == '(':
+                depth += 1
+            elif c == ')':
+                depth -= 1
+        elif c == '(' and token:
+            token += c
+            depth = 1
+        elif c in '()' or c.isspace():
+            if token:
+                tokens.append(token)
+                token = ''
+            if c in '()':
+                tokens.append(c)
+        else:
+            token += c
+    if token:
+        tokens.append(token)
+    return tokens
+
+
+def _rich_dep_names(tokens, pos):
+    """ Parse the rich dependency expression starting after the "(" at
+    tokens[pos - 1]. Returns the names a requirement on it matches, as
+    libsolv does, and the position after the closing ")".
+    """
+    operands = []
+    keywords = []
+    while pos < len(tokens):
+        token = tokens[pos]
+        pos += 1
+        if token == ')':
+            break
+        if token == '(':
+            names, pos = _rich_dep_names(tokens, pos)
+            operands.append(names)
+        elif token in RICH_DEP_KEYWORDS:
+            keywords.append(token)
+        elif token in RICH_DEP_OPERATORS:
+            # skip the version of a comparison
+            pos += 1
+        else:
+            operands.append([token])
+    if not keywords:
+        return [name for names in operands for name in names], pos
+    if keywords[0] in ('if', 'unless'):
+        # only the "then" and "else" branches are required, not the
+        # condition
+        operands = operands[:1] + operands[2:3]
+    elif keywords[0] == 'without':
+        operands = operands[:1]
+    return [name for names in operands for name in names], pos
+
+
+def dep_names(dep):
+    """ Return the names in a provide or require string, i.e.
+
+    >>> dep_names("foo >= 1.0")
+    ['foo']
+    >>> dep_names("(foo or bar > 2)")
+    ['foo', 'bar']
+    >>> dep_names("(python3dist(foo) >= 1.0 with python3dist(foo) < 2)")
+    ['python3dist(foo)']
+    >>> dep_names("(python3dist(foo) or python3dist(bar) >= 2)")
+    ['python3dist(foo)', 'python3dist(bar)']
+    >>> dep_names("(python3dist(foo) if (bar or python3-baz))")
+    ['python3dist(foo)']
+    >>> dep_names("(foo unless bar else (baz or qux))")
+    ['foo', 'baz', 'qux']
+    >>> dep_names("(foo without bar)")
+    ['foo']
+    """
+    dep = str(dep)
+    if not dep.startswith('('):
+        base_dep, *_ = dep.split()
+        return [base_dep]
+    names = []
+    tokens = rich_dep_tokens(dep)
+    for name in _rich_dep_names(tokens, 1)[0]:
+        if name not in names:
+            names.append(name)
+    return names
+
+
+def normalize_file(filename):
+    # pkg.files is a list of paths
+    # sometimes paths start with "//" instead of "/"
+    # normalise "//" to "/":
+    # os.path.normpath("//") == "//", but
+    # os.path.normpath("///") == "/"
+    return os.path.normpath(f'//{filename}')
+
+
 class DepChecker:
-    def __init__(self, release, repo=None, source_repo=None, namespace='rpms'):
+    def __init__(self, release, repo=None, source_repo=None, namespace='rpms',
+                 cachedir=DNF_CACHEDIR, metadata_expire=METADATA_EXPIRE,
+                 offline=False, repos=None):
         self._src_by_bin = None
         self._bin_by_src = None
+        self._src_by_nvr = None
+        self._providers = None
+        self._requirers = None
+        self._dependant_srpms = {}
         self.release = release
 
-        dnfquery = setup_dnf(release=release)
+        dnfquery = setup_dnf(release=release, cachedir=cachedir,
+                             metadata_expire=metadata_expire,
+                             offline=offline, repos=repos)
         self.dnfquery = dnfquery
         self.pagure_dict = {}
         self.not_in_repo = []
 
+    def create_src_index(self):
+        src_by_nvr = {}  # Dict of source pkg objects by (name, version, rel)
+
+        for src_package in self.dnfquery.filter(arch='src'):
+            nvr = (src_package.name, src_package.version, src_package.release)
+            current = src_by_nvr.get(nvr)
+            # Same as latest=1, keep the highest epoch
+            if current is None or src_package.epoch > current.epoch:
+                src_by_nvr[nvr] = src_package
+
+        self._src_by_nvr = src_by_nvr
+
+    @property
+    def by_nvr(self):
+        if self._src_by_nvr is None:
+            self.create_src_index()
+        return self._src_by_nvr
+
     def create_mapping(self):
         src_by_bin = {}  # Dict of source pkg objects by binary package objects
         bin_by_src = {}  # Dict of binary pkgobjects by srpm name
 
+        start = time.time()
         # Populate the dicts
         for rpm_package in self.dnfquery:
             if rpm_package.arch == 'src':
@@ -116,6 +359,8 @@ class DepChecker:
 
         self._src_by_bin = src_by_bin
         self._bin_by_src = bin_by_src
+        eprint("Created source/binary packages mapping in %.2f seconds" %
+               (time.time() - start))
 
     @property
     def by_src(self):
@@ -129,6 +374,50 @@ class DepChecker:
             self.create_mapping()
         return self._src_by_bin
 
+    def create_dep_index(self):
+        """ Index the latest binary packages by the names they provide,
+        including the files required by some package, and by the names they
+        require, so dependencies are resolved with dict lookups instead of
+        one libsolv query per provide.
+        """
+        providers = {}  # Dict of sets of packages by provide name or file
+        requirers = {}  # Dict of sets of packages by required name
+
+        start = time.time()
+        packages = [rpm_package for rpm_package
+                    in self.dnfquery.filter(latest=1)
+                    if rpm_package.arch != 'src']
+        for rpm_package in packages:
+            for prov in rpm_package.provides:
+                for name in dep_names(prov):
+                    providers.setdefault(name, set()).add(rpm_package)
+            for req in rpm_package.requires:
+                for name in dep_names(req):
+                    requirers.setdefault(name, set()).add(rpm_package)
+        # Files are only needed as providers of the required paths
+        for rpm_package in packages:
+            for fn in rpm_package.files:
+                fn = normalize_file(fn)
+                if fn in requirers:
+                    providers.setdefault(fn, set()).add(rpm_package)
+
+        self._providers = providers
+        self._requirers = requirers
+        eprint("Created dependencies index in %.2f seconds" %
+               (time.time() - start))
+
+    @property
+    def providers(self):
+        if self._providers is None:
+            self.create_dep_index()
+        return self._providers
+
+    @property
+    def requirers(self):
+        if self._requirers is None:
+            self.create_dep_index()
+        return self._requirers
+
     def find_dependent_packages(self, srpmname, ignore):
         """ Return packages depending on packages built from SRPM ``srpmname``
             that are built from different SRPMS not specified in ``ignore``.
@@ -153,6 +442,8 @@ class DepChecker:
             self.not_in_repo.append(srpmname)
             rpms = []
 
+        rpms_set = set(rpms)
+
         # provides of all packages built from ``srpmname``
         provides = []
         for pkg in rpms:
@@ -161,12 +452,7 @@ class DepChecker:
             provides.extend(string_provides)
 
             # add all files as provides
-            # pkg.files is a list of paths
-            # sometimes paths start with "//" instead of "/"
-            # normalise "//" to "/":
-            # os.path.normpath("//") == "//", but
-            # os.path.normpath("///") == "/"
-            file_provides = [os.path.normpath(f'//{fn}') for fn in pkg.files]
+            file_provides = [normalize_file(fn) for fn in pkg.files]
             provides.extend(file_provides)
 
         # Zip through the provides and find what's needed
@@ -175,28 +461,20 @@ class DepChecker:
             # "foo = 1.fc20" -> "foo"
             base_provide, *_ = prov.split()
 
-            # FIXME: Workaround for:
-            # https://bugzilla.redhat.com/show_bug.cgi?id=1191178
-            if base_provide[0] == "/":
-                base_provide = base_provide.replace("[", "?")
-                base_provide = base_provide.replace("]", "?")
-
             # Elide provide if also provided by another package
-            for pkg in self.dnfquery.filter(provides=base_provide, latest=1):
+            for pkg in self.providers.get(base_provide, ()):
                 # FIXME: might miss broken dependencies in case the other
                 # provider depends on a to-be-removed package as well
                 if pkg.name in ignore:
                     # eprint(f"Ignoring provider package {pkg.name}")
                     pass
-                elif pkg not in rpms:
+                elif pkg not in rpms_set:
                     break
             else:
-                for dependent_pkg in self.dnfquery.filter(
-                        latest=1,
-                        requires=base_provide):
+                for dependent_pkg in self.requirers.get(base_provide, ()):
                     # skip if the dependent rpm package belongs to the
                     # to-be-removed Fedora package
-                    if dependent_pkg in self.by_src[srpmname]:
+                    if dependent_pkg in rpms_set:
                         continue
 
                     # skip if the dependent rpm package is also a
@@ -210,6 +488,55 @@ class DepChecker:
                         prov)
         return OrderedDict(sorted(dependent_packages.items()))
 
+    def src_name(self, package):
+        """ Return the name of the source package of a binary package """
+        srpm = self.by_bin.get(package)
+        if srpm:
+            return srpm.name
+        sname, *_ = package.sourcerpm.rsplit('-', 2)
+        return sname
+
+    def find_dependent_srpms(self, srpmname, ignore):
+        """ Return the set of names of the source packages of the packages
+            returned by find_dependent_packages. Results are memoized.
+        """
+        key = (srpmname, frozenset(ignore))
+        if key not in self._dependant_srpms:
+            dependants = self.find_dependent_packages(srpmname, ignore)
+            self._dependant_srpms[key] = set(self.src_name(dep)
+                                             for dep in dependants)
+        return self._dependant_srpms[key]
+
+    def find_transitive_dependants(self, srpmname, ignore, max_depth=None):
+        """ Return the reverse dependency closure of SRPM ``srpmname``,
+            expanding dependant source packages breadth first. Each source
+            package is reported only in the first level where it's found,
+            so dependency cycles are not expanded again.
+
+            :param max_depth: maximum number of levels, no limit if None
+
+            :returns: list of levels, each level is an OrderedDict
+                {srpm_name: [srpm names of the previous level it depends on]}
+        """
+        levels = []
+        visited = {srpmname}
+        current = [srpmname]
+        while current and (max_depth is None or len(levels) < max_depth):
+            level = {}
+            for parent in current:
+                for dependant in self.find_dependent_srpms(parent, ignore):
+                    if dependant in visited and dependant not in level:
+                        continue
+                    level.setdefault(dependant, []).append(parent)
+            visited.update(level.keys())
+            if not level:
+                break
+            levels.append(OrderedDict(
+                (name, sorted(parents)) for name, parents
+                in sorted(level.items())))
+            current = list(levels[-1].keys())
+        return levels
+
     # This function was stolen from pungi
     def SRPM(self, package):
         """Given a package object, get a package object for the
@@ -217,34 +544,200 @@ class DepChecker:
         and a valid package object."""
         srpm, *_ = package.sourcerpm.split('.src.rpm')
         sname, sver, srel = srpm.rsplit('-', 2)
-        return srpm_nvr_object(self.dnfquery, sname, sver, srel)
+        return self.by_nvr.get((sname, sver, srel))
 
 
-def srpm_nvr_object(query, name, version, release):
-    try:
-        srpmpo = query.filter(name=name,
-                              version=version,
-                              release=release,
-                              latest=1,
-                              arch='src').run()[0]
-        return srpmpo
-    except IndexError:
-        pass
+def dependants_report(depchecker, srpmname, ignore):
+    """ Return the dependants of ``srpmname`` as a list of dicts with plain
+        strings, so they can be serialized or sent between processes.
+    """
+    dependants = depchecker.find_dependent_packages(srpmname, ignore)
+    return [{'package': dep.name + "-" + dep.evr + "." + dep.arch,
+             'repo': str(dep.reponame),
+             'requires': sorted(provs)}
+            for dep, provs in dependants.items()]
+
+
+def transitive_report(depchecker, srpmname, ignore, max_depth=None):
+    """ Return the transitive dependants of ``srpmname`` as a list of dicts
+        {'level': n, 'package': srpm_name, 'via': [srpm_name, ...]}.
+    """
+    levels = depchecker.find_transitive_dependants(srpmname, ignore,
+                                                   max_depth=max_depth)
+    return [{'level': n, 'package': name, 'via': parents}
+            for n, level in enumerate(levels, 1)
+            for name, parents in level.items()]
+
+
+# DepChecker and report function used by worker processes, set before
+# forking them so they share the dnf sack and indexes built by the parent
+# process.
+_worker_depchecker = None
+_worker_report_func = None
+
+
+def _worker_report(srpmname):
+    return srpmname, _worker_report_func(_worker_depchecker, srpmname)
+
+
+def bulk_dependants_report(depchecker, srpmnames, ignore=None, workers=1,
+                           transitive=False, max_depth=None):
+    """ Return an OrderedDict {srpmname: report} for a list of source
+        packages, with dependants_report, or transitive_report if
+        ``transitive`` is True. Mappings and indexes are built once and, if
+        workers > 1, packages are evaluated by a pool of forked processes.
+    """
+    ignore = ignore or []
+
+    def report_func(depchecker, srpmname):
+        if transitive:
+            return transitive_report(depchecker, srpmname, ignore,
+                                     max_depth=max_depth)
+        return dependants_report(depchecker, srpmname, ignore)
+
+    # Build mappings and indexes before forking
+    depchecker.by_src
+    depchecker.providers
+    if workers > 1:
+        global _worker_depchecker, _worker_report_func
+        _worker_depchecker = depchecker
+        _worker_report_func = report_func
+        ctx = multiprocessing.get_context('fork')
+        with ctx.Pool(workers) as pool:
+            results = pool.map(_worker_report, srpmnames)
+    else:
+        results = [(name, report_func(depchecker, name))
+                   for name in srpmnames]
+    return OrderedDict(results)
+
+
+def read_pkg_list(pkg_list):
+    if pkg_list == '-':
+        lines = sys.stdin.readlines()
+    else:
+        with open(pkg_list, 'r') as f:
+            lines = f.readlines()
+    return [line.strip() for line in lines
+            if line.strip() and not line.startswith('#')]
+
+
+def print_report(report, output_format, transitive=False):
+    if output_format == 'json':
+        print(json.dumps(report, indent=2))
+    elif output_format == 'csv':
+        writer = csv.writer(sys.stdout)
+        if transitive:
+            writer.writerow(['source_package', 'level', 'dependant', 'via'])
+        else:
+            writer.writerow(['source_package', 'dependant', 'repo',
+                             'requires'])
+        for srpmname, dependants in report.items():
+            for dep in dependants:
+                if transitive:
+                    writer.writerow([srpmname, dep['level'], dep['package'],
+                                     ' '.join(dep['via'])])
+                else:
+                    writer.writerow([srpmname, dep['package'], dep['repo'],
+                                     ' '.join(dep['requires'])])
+    else:
+        for srpmname, dependants in report.items():
+            level = 0
+            for dep in dependants:
+                if not transitive:
+                    print(srpmname + ": " + dep['package'] + " from " +
+                          dep['repo'])
+                    continue
+                if dep['level'] != level:
+                    level = dep['level']
+                    print("%s: level %s" % (srpmname, level))
+                print("    " + dep['package'] + " (via " +
+                      ", ".join(dep['via']) + ")")
 
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--release",
-                        choices=["master", "wallaby", "victoria", "ussuri",
-                                 "train"],
-                        default="master")
-    parser.add_argument("--pkg-name")
+    parser.add_argument("--release", default="master",
+                        help="OpenStack release (default: %(default)s)")
+    parser.add_argument("--distro", default=DEFAULT_DISTRO,
+                        help="Distro of the repos to use, one of %s or any "
+                             "distro in --repos-config (default: %%(default)s)"
+                             % ", ".join(DISTRO_REPOS))
+    parser.add_argument("--repos-config",
+                        help="yaml or .repo file with the repos to use "
+                             "instead of the default ones")
+    parser.add_argument("--repos", action="append", default=[],
+                        help="Load only these repos, accepts shell patterns "
+                             "(i.e. 'rdo-c*'), can be used several times")
+    pkgs = parser.add_mutually_exclusive_group(required=True)
+    pkgs.add_argument("--pkg-name")
+    pkgs.add_argument("--pkg-list",
+                      help="File with a source package name per line, "
+                           "use - to read it from stdin")
+    parser.add_argument("--ignore-listed", action="store_true",
+                        default=False,
+                        help="Do not report packages built from the listed "
+                             "source packages as dependants, i.e. when "
+                             "all of them are retired together")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes evaluating packages in "
+                             "--pkg-list mode")
+    parser.add_argument("--output-format", choices=["text", "json", "csv"],
+                        default="text")
+    parser.add_argument("--transitive", action="store_true", default=False,
+                        help="Report the source packages depending directly "
+                             "or indirectly on the package, grouped by level")
+    parser.add_argument("--max-depth", type=int, default=None,
+                        help="Maximum number of levels in --transitive mode")
+    parser.add_argument("--cache-dir", default=DNF_CACHEDIR,
+                        help="Directory to keep repositories metadata "
+                             "(default: %(default)s)")
+    parser.add_argument("--metadata-expire", type=int,
+                        default=METADATA_EXPIRE,
+                        help="Seconds before checking if cached repositories "
+                             "metadata is outdated (default: %(default)s)")
+    parser.add_argument("--offline", action="store_true", default=False,
+                        help="Use only cached repositories metadata")
     args = parser.parse_args()
-    eprint('Getting dependants for %s' % args.pkg_name)
-
-    depchecker = DepChecker(args.release)
-    dependants = depchecker.find_dependent_packages(args.pkg_name, [])
 
-    for dep in dependants:
-        print(dep.name + "-" + dep.evr + "." + dep.arch +
-              " from " + str(dep.reponame))
+    repos_config = None
+    if args.repos_config:
+        repos_config = load_repos_config(args.repos_config,
+                                         distro=args.distro)
+    try:
+        repos = get_repos(args.release, distro=args.distro,
+                          repos_config=repos_config, only_repos=args.repos)
+    except ValueError as e:
+        eprint(e)
+        sys.exit(1)
+    if not repos:
+        eprint("No repos selected")
+        sys.exit(1)
+
+    depchecker = DepChecker(args.release, cachedir=args.cache_dir,
+                            metadata_expire=args.metadata_expire,
+                            offline=args.offline, repos=repos)
+
+    if args.pkg_name:
+        eprint('Getting dependants for %s' % args.pkg_name)
+        if args.output_format == 'text' and not args.transitive:
+            dependants = depchecker.find_dependent_packages(args.pkg_name,
+                                                            [])
+            for dep in dependants:
+                print(dep.name + "-" + dep.evr + "." + dep.arch +
+                      " from " + str(dep.reponame))
+            return
+        srpmnames = [args.pkg_name]
+    else:
+        srpmnames = read_pkg_list(args.pkg_list)
+        eprint('Getting dependants for %s packages' % len(srpmnames))
+
+    ignore = []
+    if args.ignore_listed:
+        for srpmname in srpmnames:
+            ignore.extend(pkg.name for pkg in depchecker.by_src.get(srpmname,
+                                                                    []))
+    report = bulk_dependants_report(depchecker, srpmnames, ignore=ignore,
+                                    workers=args.workers,
+                                    transitive=args.transitive,
+                                    max_depth=args.max_depth)
+    print_report(report, args.output_format, transitive=args.transitive)
@@ -21,6 +21,11 @@ def parse_args():
                         help='Number of days to list new releases')
     parser.add_argument('-n', '--review-number', dest='number', default=None,
                         help='Review number')
+    parser.add_argument('--releases-mirror', dest='releases_mirror',
+                        default=None,
+                        help='Path to a local mirror of openstack/releases '
+                             'used to read deliverable files. It is cloned '
+                             'if it does not exist')
     return parser.parse_args()
 
 
@@ -31,15 +36,17 @@ def format_time(time):
 
 def main():
     args = parse_args()
+    if args.releases_mirror:
+        releases_utils.set_releases_mirror(args.releases_mirror)
     if args.number:
         after_fmt = None
     else:
         after = datetime.datetime.now() - datetime.timedelta(days=args.days)
         after_fmt = after.strftime('%Y-%m-%d')
-    reviews = review_utils.get_osp_releases_reviews(args.release,
-                                                    after=after_fmt,
-                                                    number=args.number,
-                                                    status='merged')
+    reviews = review_utils.iter_osp_releases_reviews(args.release,
+                                                     after=after_fmt,
+                                                     number=args.number,
+                                                     status='merged')
 
     distroinfo = info.DistroInfo(
         info_files='rdo.yml',
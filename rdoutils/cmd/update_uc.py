@@ -5,12 +5,13 @@
 # curl -OJ https://opendev.org/openstack/requirements/raw/branch/master/upper-constraints.txt # noqa
 # * stable/ocata
 # curl -OJ https://opendev.org/openstack/requirements/raw/branch/stable/ocata/upper-constraints.txt # noqa
+# or with --release, which downloads it only when modified since the last run.
 
 import argparse
 import copy
 
-from distroinfo import info
 from rdoutils import rdoinfo
+from rdoutils import uc_utils
 
 
 def parse_args():
@@ -21,17 +22,19 @@ def parse_args():
                         help='tag to update')
     parser.add_argument('-l', '--rdoinfo-location', dest='location',
                         default='.', help='rdoinfo location')
+    parser.add_argument('-r', '--release', dest='release', default=None,
+                        help='download upper-constraints for this release '
+                        '(master or stable release name) instead of using '
+                        'the local %s file' % UC)
+    parser.add_argument('--offline', dest='offline', action='store_true',
+                        help='with --release, use the cached '
+                        'upper-constraints file without downloading it')
     return parser.parse_args()
 
 
 SOURCE_BRANCH = 'source-branch'
 UC = 'upper-constraints.txt'
 
-# Exceptions for rdoinfo project name != project in upper-constraints
-UC_EXCEPTIONS = {
-  "glance_store": "glance-store",
-}
-
 
 # filter for Oslo and clients
 def filter_oslo_clients(project):
@@ -65,17 +68,17 @@ def filter_all_minus_tripleo(project):
 
 # load and filter upper-constraints.txt
 # normalize project name for rdoinfo
-def load_uc(projects_filter):
+def load_uc(projects_filter, release=None, offline=False):
+    if release:
+        content = uc_utils.get_uc(uc_utils.uc_branch(release),
+                                  offline=offline)
+    else:
+        with open(UC, 'rb') as ucfile:
+            content = ucfile.read().decode('utf8')
     uc = {}
-    with open(UC, 'rb') as ucfile:
-        for line in ucfile.readlines():
-            name, version_spec = line.decode('utf8').rstrip().split('===')
-            if name and projects_filter(name):
-                version = version_spec.split(';')[0]
-                if version:
-                    if name.startswith('python-'):
-                        name = name[7:]
-                    uc[name.replace('.', '-')] = version
+    for name, version in uc_utils.parse_uc(content).items():
+        if projects_filter(name):
+            uc[uc_utils.rdoinfo_name(name)] = version
     return uc
 
 
@@ -83,17 +86,19 @@ def update_uc():
     args = parse_args()
     release_tag = args.tag
     rdoinfo_dir = args.location
-    uc = load_uc(filter_all_minus_tripleo)
+    uc = load_uc(filter_all_minus_tripleo, release=args.release,
+                 offline=args.offline)
     uc_projects = list(uc.keys())
 
-    distroinfo = info.DistroInfo(info_files='rdo-full.yml',
-                                 local_info=rdoinfo_dir)
-    info_rdo = distroinfo.get_info()
+    info_rdo = rdoinfo.get_inforepo(info_files='rdo-full.yml',
+                                    local_dir=rdoinfo_dir)
+    tags_update = rdoinfo.TagsUpdate(info_files='rdo-full.yml',
+                                     local_dir=rdoinfo_dir, atomic=True)
     DEFAULT_RELEASES = info_rdo['package-default']['tags']
     RELEASES_PUPPET = info_rdo['package-configs']['rpmfactory-puppet']['tags']
     for pkg in info_rdo['packages']:
         project = pkg['project']
-        project_uc = UC_EXCEPTIONS.get(project, project)
+        project_uc = uc_utils.uc_name(project)
         if project_uc in uc_projects:
             new_version = uc[project_uc]
             # "Setting %s to version %s" % (project, new_version)
@@ -130,20 +135,19 @@ def update_uc():
                 if prev_version != new_version:
                     print("%s updated from %s to %s" %
                           (project, prev_version, new_version))
-                    rdoinfo.update_tag('tags', project, release_tag, tag_value,
-                                       local_dir=rdoinfo_dir)
+                    tags_update.add('tags', project, release_tag, tag_value)
                 else:
                     print("%s %s already up to date" %
                           (project, new_version))
             else:
                 print("%s first time pin to %s" %
                       (project, new_version))
-                rdoinfo.update_tag('tags', project, release_tag, tag_value,
-                                   local_dir=rdoinfo_dir)
+                tags_update.add('tags', project, release_tag, tag_value)
             uc_projects.remove(project_uc)
         else:
             # "%s not found in upper-constraints" % project
             pass
+    tags_update.apply()
 
 
 if __name__ == '__main__':
@@ -1,7 +1,20 @@
 import argparse
+import io
 import pandas
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from rdoutils import cache_utils
 from rdoutils import review_utils
-import urllib.error
+
+# Seconds to keep results of Gerrit queries
+GERRIT_CACHE_TTL = 300
+# Number of status reports downloaded concurrently
+DOWNLOAD_WORKERS = 8
+DEFAULT_CACHE_DIR = cache_utils.get_cache_dir('ftbfs')
+# Seconds to wait for the server when downloading a report
+DOWNLOAD_TIMEOUT = 60
+
+http_session = requests.Session()
 
 
 def parse_args():
@@ -16,10 +29,35 @@ def parse_args():
                         required=False,
                         help='File to store generated report. If empty, report'
                              ' will be displayed to stdout.')
+    parser.add_argument('-c', '--cache-dir', dest='cache_dir',
+                        default=DEFAULT_CACHE_DIR,
+                        help='Directory to keep downloaded reports, they are'
+                             ' only downloaded again when modified. Set it'
+                             ' to an empty value to disable it.')
     return parser.parse_args()
 
 
-def get_ftbfs_failures(release):
+def download_report(url, cache_dir=None):
+    """
+    This function is downloading the report in url and returns its content.
+    If cache_dir is set, the report is stored there with its ETag and
+    Last-Modified headers and it's only downloaded again when the server
+    reports it has been modified. Returns None if it can't be downloaded.
+    """
+    try:
+        status, content = cache_utils.cached_download(
+            url, cache_dir or None, session=http_session,
+            timeout=DOWNLOAD_TIMEOUT)
+    except requests.exceptions.RequestException as e:
+        print("Could not download report url", url, ":", e)
+        return None
+    if content is None:
+        print("Result: ", status)
+        print("Specified report url", url, "does not exists.")
+    return content
+
+
+def get_ftbfs_failures(release, cache_dir=None):
     """
     This function is parsing csv report to look for any occurenence
     of FTBFS and store this information
@@ -27,19 +65,15 @@ def get_ftbfs_failures(release):
     url = "https://trunk.rdoproject.org/%s/status_report.csv" % release
     print("INFO: Analysing report from URL: ", url)
 
-    try:
-        df_data = pandas.read_csv(url, index_col='Project')
-    except urllib.error.HTTPError as e:
-        print("Result: ", e.code, e.reason)
-        print("Specified report url", url, "does not exists.")
+    report = download_report(url, cache_dir=cache_dir)
+    if report is None:
         return
+    df_data = pandas.read_csv(io.StringIO(report), index_col='Project')
 
     df_data.drop(["Extended Sha", "Packages"], axis=1, inplace=True)
     failed_reviews = df_data[df_data["Status"] == "FAILED"]
     if not failed_reviews.empty:
-        for project in failed_reviews.index:
-            failed_reviews = failed_reviews.assign(Release=release)
-        return failed_reviews
+        return failed_reviews.assign(Release=release)
 
 
 def expand_report(report_df):
@@ -54,36 +88,34 @@ def expand_report(report_df):
         print("INFO: Current FTBFS report has no entries.")
         return report_df
 
-    report_df["Review"] = None
-    report_df["Logs"] = None
-    # TODO: enable source commit hash
-    # report["Commit"] = None
-    report_df["Date of FTBFS"] = None
-
     report_df.reset_index(inplace=True)
 
-    for index in report_df.index:
-        component = report_df["Release"][index]
-        if "centos7-train" not in component:
-            component += "/component/" + report_df['Component'][index]
-        rpmbuild_log = "https://trunk.rdoproject.org/" \
-                       + component + "/" \
-                       + report_df['Source Sha'][index][:2] + "/" \
-                       + report_df['Source Sha'][index][2:4] + "/" \
-                       + report_df['Source Sha'][index] + "_" \
-                       + report_df['Dist Sha'][index][:8] + "/rpmbuild.log"
-
-        ftbfs_date = pandas.to_datetime(report_df['Timestamp'][index],
-                                        unit='s')
-        ftbfs_review = find_ftbfs_reviews(report_df["Project"]
-                                          [index].split("-")[1],
-                                          report_df["Release"]
-                                          [index].split("-")[1],
-                                          "open")
-
-        report_df.loc[index, "Logs"] = rpmbuild_log
-        report_df.loc[index, "Date of FTBFS"] = ftbfs_date
-        report_df.loc[index, "Review"] = ftbfs_review
+    releases = report_df["Release"]
+    component = releases.where(
+        releases.str.contains("centos7-train", regex=False),
+        releases + "/component/" + report_df["Component"])
+    source_sha = report_df["Source Sha"]
+    rpmbuild_log = "https://trunk.rdoproject.org/" \
+                   + component + "/" \
+                   + source_sha.str[:2] + "/" \
+                   + source_sha.str[2:4] + "/" \
+                   + source_sha + "_" \
+                   + report_df["Dist Sha"].str[:8] + "/rpmbuild.log"
+
+    branches = releases.map(release_branch)
+    ftbfs_reviews = get_ftbfs_reviews(set(branches), "open")
+    projects = report_df["Project"].str.split("-").str[1]
+    ftbfs_review = pandas.Series(
+        [find_ftbfs_review(ftbfs_reviews, project, branch)
+         for project, branch in zip(projects, branches)],
+        index=report_df.index, dtype=object)
+
+    report_df["Review"] = ftbfs_review
+    report_df["Logs"] = rpmbuild_log
+    # TODO: enable source commit hash
+    # report["Commit"] = None
+    report_df["Date of FTBFS"] = pandas.to_datetime(report_df["Timestamp"],
+                                                    unit='s')
 
     report_df.drop(["Timestamp", "Source Sha", "Dist Sha"],
                    axis=1, inplace=True)
@@ -92,35 +124,53 @@ def expand_report(report_df):
     return report_df
 
 
-def find_ftbfs_reviews(project, branch, status):
+def release_branch(release):
     """
-    This function is calling gerrit API to list all current
-    FTBFS reviews, with specified project, branch and status.
+    Return the distgit branch for a release in the status report, i.e.
+    centos9-master -> rpm-master, centos9-epoxy -> epoxy-rdo.
     """
-    client = review_utils.get_gerrit_client('rdo')
-    gerrit_url = 'https://review.rdoproject.org/r/#/c/'
+    branch = release.split("-")[1]
+    if "master" in branch:
+        return "rpm-master"
+    return branch + "-rdo"
 
-    if branch and "master" in branch:
-        branch = "rpm-master"
-    elif branch:
-        branch = branch + "-rdo"
 
-    reviews = review_utils.get_reviews_project(client, project,
-                                               branch=branch,
-                                               status=status,
-                                               intopic="FTBFS")
+def get_ftbfs_reviews(branches, status):
+    """
+    This function is calling gerrit API once to list all current FTBFS
+    reviews with specified status, and returns the latest review number for
+    each project in the specified branches as a dict
+    {branch: {project: review_number}}.
+    """
+    client = review_utils.get_gerrit_client('rdo',
+                                            cache_ttl=GERRIT_CACHE_TTL)
+    ftbfs_reviews = {branch: {} for branch in branches}
+    url = "/changes/?q=intopic:FTBFS+status:%s" % status
+    for review in review_utils.iter_changes(client, url):
+        if review['branch'] not in ftbfs_reviews:
+            continue
+        projects = ftbfs_reviews[review['branch']]
+        if projects.get(review['project'], 0) < review['_number']:
+            projects[review['project']] = review['_number']
+    return ftbfs_reviews
+
+
+def find_ftbfs_review(ftbfs_reviews, project, branch):
+    """
+    Return the url of the latest FTBFS review for a project and branch
+    from the reviews returned by get_ftbfs_reviews. As project is the
+    package name without prefix, it's matched as substring of the gerrit
+    project name.
+    """
+    gerrit_url = 'https://review.rdoproject.org/r/#/c/'
+    reviews = [number for name, number in
+               ftbfs_reviews.get(branch, {}).items() if project in name]
     if reviews:
-        latest_review = 0
-        for review in reviews[::-1]:
-            if latest_review < review['_number']:
-                latest_review = review['_number']
-
-        return gerrit_url + str(latest_review)
+        return gerrit_url + str(max(reviews))
 
 
 def main():
     releases = []
-    ftbfs_failures_df = pandas.DataFrame()
 
     args = parse_args()
 
@@ -131,9 +181,15 @@ def main():
     else:
         releases = args.release
 
-    for release in releases:
-        ftbfs_failures_df = pandas.concat([ftbfs_failures_df,
-                                           get_ftbfs_failures(release)])
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+        failures = list(executor.map(
+            lambda r: get_ftbfs_failures(r, cache_dir=args.cache_dir),
+            releases))
+    failures = [f for f in failures if f is not None]
+    if failures:
+        ftbfs_failures_df = pandas.concat(failures)
+    else:
+        ftbfs_failures_df = pandas.DataFrame()
 
     if args.report_file is None:
         print(expand_report(ftbfs_failures_df))
@@ -1,10 +1,17 @@
 
+import copy
+import hashlib
 import os
+import pickle
 import re
+import shutil
+import tempfile
+import time
 from ruamel.yaml import YAML
 
 from distroinfo import info
 from distroinfo import query
+from rdoutils import cache_utils
 from rdoutils import cbs_utils
 from rdopkg.utils import git
 from rdopkg import helpers
@@ -13,15 +20,212 @@ local_info = os.environ['HOME'] + '/rdoinfo'
 if not os.path.exists(local_info):
     os.makedirs(local_info)
 
+# Directory used to store serialized snapshots of parsed rdoinfo
+cache_dir = cache_utils.get_cache_dir('rdoinfo')
+
+# Parsed inforepos by (local_dir, info_files), each entry is a tuple
+# (fingerprint, inforepo, time the fingerprint was computed).
+all_inforepos = {}
+# Seconds during which a parsed inforepo is used without checking if the
+# rdoinfo checkout changed
+FINGERPRINT_INTERVAL = 30
+# Package indexes by (local_dir, info_files)
+all_indexes = {}
+
+re_distgit = re.compile('.*?((puppet|openstack)/.*).git')
+
+
+def _cache_key(info_files, local_dir):
+    key = "%s:%s" % (os.path.realpath(local_dir), info_files)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def _fingerprint(local_dir):
+    """ Return a digest of the yaml files in local_dir. Any change in
+    the rdoinfo checkout (git pull, checkout or local edits) modifies
+    the mtime or size of the changed files, so the digest changes too.
+    """
+    digest = hashlib.sha1()
+    for root, dirs, files in os.walk(local_dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        for filename in sorted(files):
+            if not filename.endswith(('.yml', '.yaml')):
+                continue
+            path = os.path.join(root, filename)
+            stat = os.stat(path)
+            entry = "%s:%s:%s\n" % (os.path.relpath(path, local_dir),
+                                    stat.st_mtime_ns, stat.st_size)
+            digest.update(entry.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _snapshot_path(key, fingerprint):
+    filename = "rdoinfo-%s-%s.pickle" % (key, fingerprint)
+    return os.path.join(cache_dir, filename)
+
+
+def _load_snapshot(key, fingerprint):
+    if not cache_dir:
+        return None
+    try:
+        with open(_snapshot_path(key, fingerprint), 'rb') as infile:
+            return pickle.load(infile)
+    except Exception:
+        return None
+
+
+def _write_snapshot(key, fingerprint, inforepo):
+    if not cache_dir:
+        return
+    try:
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        snapshot_path = _snapshot_path(key, fingerprint)
+        # Remove outdated snapshots for the same rdoinfo checkout, other
+        # processes may be removing them too
+        prefix = "rdoinfo-%s-" % key
+        for filename in os.listdir(cache_dir):
+            path = os.path.join(cache_dir, filename)
+            if filename.startswith(prefix) and path != snapshot_path:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        if os.path.exists(snapshot_path):
+            # Already written by another process
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as outfile:
+            pickle.dump(inforepo, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, snapshot_path)
+    except OSError:
+        # The cache is an optimization, never fail because of it
+        pass
+
+
+def get_inforepo(info_files='rdo.yml', local_dir=local_info):
+    """ Return the parsed rdoinfo in local_dir.
+
+    Parsed information is cached in memory for the whole process and
+    serialized in cache_dir, keyed on the content of the checkout, so
+    it is only parsed again when any yaml file changes. Changes in the
+    checkout are checked at most every FINGERPRINT_INTERVAL seconds, use
+    clear_inforepo_cache to check them on next call. The returned dict is
+    shared by all callers and must not be modified, use copy.deepcopy if
+    needed.
+    """
+    key = _cache_key(info_files, local_dir)
+    now = time.time()
+    try:
+        cached_fingerprint, inforepo, checked = all_inforepos[key]
+        if now - checked < FINGERPRINT_INTERVAL:
+            return inforepo
+    except KeyError:
+        cached_fingerprint = None
+    fingerprint = _fingerprint(local_dir)
+    if cached_fingerprint == fingerprint:
+        all_inforepos[key] = (fingerprint, inforepo, now)
+        return inforepo
+    inforepo = _load_snapshot(key, fingerprint)
+    if inforepo is None:
+        distroinfo = info.DistroInfo(
+            info_files=info_files,
+            local_info=local_dir)
+        inforepo = distroinfo.get_info()
+        _write_snapshot(key, fingerprint, inforepo)
+    all_inforepos[key] = (fingerprint, inforepo, now)
+    return inforepo
+
+
+def clear_inforepo_cache():
+    all_inforepos.clear()
+    all_indexes.clear()
+
+
+def _normalize_url(url):
+    url = url.rstrip('/')
+    if url.endswith('.git'):
+        url = url[:-4]
+    return url
+
+
+class PackagesIndex(object):
+    """ Lookup tables for the packages in an inforepo.
+
+    All tables are built in a single pass over the packages, and lists
+    of packages keep the order they have in rdoinfo.
+    """
+
+    def __init__(self, inforepo):
+        self.inforepo = inforepo
+        self.packages = inforepo['packages']
+        self.by_project = {}
+        self.by_name = {}
+        self.by_upstream = {}
+        self.by_tag = {}
+        self.by_buildsys_tag = {}
+        self.by_distgit = {}
+        self.distgit_by_project = {}
+        for package in self.packages:
+            self.by_project.setdefault(package['project'], package)
+            self.by_name.setdefault(package['name'], []).append(package)
+            if package.get('upstream'):
+                upstream = _normalize_url(package['upstream'])
+                self.by_upstream.setdefault(upstream, []).append(package)
+            for tag in package.get('tags') or {}:
+                self.by_tag.setdefault(tag, []).append(package)
+            for tag in package.get('buildsys-tags') or {}:
+                self.by_buildsys_tag.setdefault(tag, []).append(package)
+            # For some packages as dependencies, review-origin is None
+            distgit_url = package.get('review-origin')
+            if distgit_url:
+                distgit = re.search(re_distgit, distgit_url)
+                if distgit:
+                    distgit_short = distgit.group(1)
+                    self.by_distgit[distgit_short] = package
+                    self.distgit_by_project[package['project']] = \
+                        distgit_short
+
+    def get_project(self, project):
+        try:
+            return self.by_project[project]
+        except KeyError:
+            raise NotInRdoinfo("Project %s not found in rdoinfo" % project)
+
+    def get_by_name(self, name):
+        return self.by_name.get(name, [])
+
+    def get_by_upstream(self, url):
+        return self.by_upstream.get(_normalize_url(url), [])
+
+    def get_tagged(self, tag):
+        return self.by_tag.get(tag, [])
+
+    def get_buildsys_tagged(self, buildsys_tag):
+        return self.by_buildsys_tag.get(buildsys_tag, [])
+
+    def get_distgit(self, package):
+        return self.distgit_by_project.get(package['project'])
+
+
+def get_index(info_files='rdo.yml', local_dir=local_info):
+    """ Return the PackagesIndex for the rdoinfo in local_dir. It's
+    built once per parsed inforepo and invalidated with it.
+    """
+    inforepo = get_inforepo(info_files=info_files, local_dir=local_dir)
+    key = _cache_key(info_files, local_dir)
+    index = all_indexes.get(key)
+    if index is None or index.inforepo is not inforepo:
+        index = PackagesIndex(inforepo)
+        all_indexes[key] = index
+    return index
+
 
 def get_projects(info_files='rdo.yml', local_dir=local_info,
                  tag=None, buildsys_tag=None):
-    distroinfo = info.DistroInfo(
-        info_files=info_files,
-        local_info=local_dir)
-    inforepo = distroinfo.get_info()
+    index = get_index(info_files=info_files, local_dir=local_dir)
 
-    all_packages = inforepo['packages']
+    all_packages = index.packages
     # If tag and buildys_tag are not specified it returns
     # all packages
     if tag is None and buildsys_tag is None:
@@ -30,31 +234,156 @@ def get_projects(info_files='rdo.yml', local_dir=local_info,
     # If tag is specified, it looks for packages with the specified
     # value in tags dict.
     if tag is not None:
-        for package in all_packages:
-            if tag in package['tags'].keys():
-                pkgs_tagged.append(package)
+        pkgs_tagged.extend(index.get_tagged(tag))
     # If buildsys_tag is specified, it looks for packages with the specified
     # value in buildsys-tags dict.
     if buildsys_tag is not None:
         if 'candidate' in buildsys_tag:
-            tagged_pkg_names = cbs_utils.list_pkg_names_tagged_in(buildsys_tag)
-            for package in all_packages:
-                if (package['name'] in tagged_pkg_names):
-                    pkgs_tagged.append(package)
+            tagged_pkg_names = set(
+                cbs_utils.list_pkg_names_tagged_in(buildsys_tag))
+            pkgs_tagged.extend([p for p in all_packages
+                                if p['name'] in tagged_pkg_names])
         else:
-            for package in all_packages:
-                if ('buildsys-tags' in package.keys()
-                        and buildsys_tag in package['buildsys-tags'].keys()):
-                    pkgs_tagged.append(package)
+            pkgs_tagged.extend(index.get_buildsys_tagged(buildsys_tag))
     return pkgs_tagged
 
 
 def get_project(project, info_files='rdo.yml', local_dir=local_info):
-    all_packages = get_projects(info_files=info_files, local_dir=local_dir)
-    for package in all_packages:
-        if package['project'] == project:
-            return package
-    raise (NotInRdoinfo)
+    index = get_index(info_files=info_files, local_dir=local_dir)
+    return index.get_project(project)
+
+
+class TagsUpdate(object):
+    """ Batch of updates of tags or buildsys-tags in rdoinfo yaml files.
+
+    Updates are collected with add() and applied in memory by apply(),
+    which parses rdoinfo once and writes each affected tags file only
+    once. If atomic is True, all files are first written to temporary
+    files and only renamed when all of them have been generated.
+
+    Usage example:
+
+        with TagsUpdate(local_dir='/tmp/rdoinfo') as update:
+            update.add('tags', 'oslo-config', 'ocata',
+                       {'source-branch': '3.22.2'})
+            update.add('tags', 'oslo-log', 'ocata',
+                       {'source-branch': '3.20.1'})
+    """
+
+    def __init__(self, info_files='rdo-full.yml', local_dir=local_info,
+                 atomic=False):
+        self.info_files = info_files
+        self.local_dir = local_dir
+        self.atomic = atomic
+        self.updates = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.apply()
+
+    def add(self, tag_type, project, tag_key, tag_value, tags_filename=None,
+            update_all_files=True):
+        self.updates.append((tag_type, project, tag_key, tag_value,
+                             tags_filename, update_all_files))
+
+    def _tags_file(self, tag_type, tag, tags_filename):
+        if tags_filename:
+            return os.path.join(self.local_dir, tags_filename)
+        return os.path.join(self.local_dir, tag_type, "%s.yml" % tag)
+
+    def _pending_by_file(self):
+        """ Return the changes to do as a dict with the list of tuples
+        (tag_type, tag, project, value) to set in each tags file.
+        """
+        index = get_index(info_files=self.info_files,
+                          local_dir=self.local_dir)
+        # New tags of each (tag_type, project) after all updates
+        new_tags = {}
+        # Tags to write for each (tag_type, project), with the file
+        to_write = {}
+        for (tag_type, project, tag_key, tag_value, tags_filename,
+             update_all_files) in self.updates:
+            key = (tag_type, project)
+            if key not in new_tags:
+                package = index.get_project(project)
+                new_tags[key] = copy.deepcopy(package.get(tag_type) or {})
+                to_write[key] = {}
+            tags = new_tags[key]
+            tags[tag_key] = tag_value
+            # We update all tags for a given package to make sure we
+            # override properly the default tags from package configs the
+            # first time we update tags.
+            if update_all_files:
+                for tag in tags.keys():
+                    to_write[key][tag] = self._tags_file(tag_type, tag,
+                                                         tags_filename)
+            else:
+                to_write[key][tag_key] = self._tags_file(tag_type, tag_key,
+                                                         tags_filename)
+        pending = {}
+        for (tag_type, project), tag_files in to_write.items():
+            tags = new_tags[(tag_type, project)]
+            for tag, tags_file in tag_files.items():
+                pending.setdefault(tags_file, []).append(
+                    (tag_type, tag, project, tags[tag]))
+        return pending
+
+    def apply(self):
+        yaml = YAML(typ='rt')
+        pending = self._pending_by_file()
+        tmp_files = []
+        try:
+            for tags_file, changes in sorted(pending.items()):
+                with open(tags_file, 'rb') as infile:
+                    tags_info = yaml.load(infile)
+                _update_tags_info(tags_info, changes)
+                if self.atomic:
+                    fd, tmp_path = tempfile.mkstemp(
+                        dir=os.path.dirname(tags_file), suffix='.tmp')
+                    tmp_files.append((tmp_path, tags_file))
+                    with os.fdopen(fd, 'w') as outfile:
+                        yaml.dump(tags_info, stream=outfile)
+                    shutil.copymode(tags_file, tmp_path)
+                else:
+                    with open(tags_file, 'w') as outfile:
+                        yaml.dump(tags_info, stream=outfile)
+        except Exception:
+            for tmp_path, _ in tmp_files:
+                os.remove(tmp_path)
+            raise
+        for tmp_path, tags_file in tmp_files:
+            os.replace(tmp_path, tags_file)
+        self.updates = []
+
+
+def _update_tags_info(tags_info, changes):
+    # if packages section is empty we can't iterate.
+    if not tags_info['packages']:
+        tags_info['packages'] = []
+    pkgs = {}
+    for pkg in tags_info['packages']:
+        pkgs.setdefault(pkg['project'], []).append(pkg)
+    for tag_type, tag, project, value in changes:
+        if project in pkgs:
+            for pkg in pkgs[project]:
+                pkg_tags = pkg.setdefault(tag_type, {})
+                if (isinstance(pkg_tags.get(tag), dict)
+                        and isinstance(value, dict)):
+                    pkg_tags[tag].update(value)
+                else:
+                    pkg_tags[tag] = value
+        else:
+            # If the package does not exist in the release file, we have
+            # to add it.
+            newpkg = {}
+            newpkg['project'] = project
+            newpkg[tag_type] = {tag: value}
+            tags_info['packages'].append(newpkg)
+            pkgs[project] = [newpkg]
+    tags_info['packages'].sort(key=lambda i: i['project'])
 
 
 def update_tag(tag_type, project, tag_key, tag_value,
@@ -81,71 +410,30 @@ def update_tag(tag_type, project, tag_key, tag_value,
                     local_dir='/tmp/nfvinfo',
                     tags_filename='openvswitch2.13.yml')
 
-
+    To update several packages, use TagsUpdate instead.
     """
-    package = get_project(project, info_files=info_files,
-                          local_dir=local_dir)
-    if tag_type not in package.keys():
-        package[tag_type] = {}
-    package[tag_type][tag_key] = tag_value
-    # We update all tags for a given package to make sure we override
-    # properly the default tags from package configs the first time
-    # we update tags.
-    for tag in package[tag_type].keys():
-        if not update_all_files:
-            if tag != tag_key:
-                continue
-        updated = False
-        if tags_filename:
-            tags_file = os.path.join(local_dir, tags_filename)
-        else:
-            tags_file = os.path.join(local_dir, tag_type, "%s.yml" % tag)
-        with open(tags_file, 'rb') as infile:
-            yaml = YAML(typ='rt')
-            tags_info = yaml.load(infile)
-        # if packages section is empty we can't iterate.
-        if tags_info['packages']:
-            for pkg in tags_info['packages']:
-                if pkg['project'] == project:
-                    if isinstance(pkg[tag_type][tag], dict):
-                        pkg[tag_type][tag].update(package[tag_type][tag])
-                    else:
-                        pkg[tag_type][tag] = package[tag_type][tag]
-                    updated = True
-        else:
-            tags_info['packages'] = []
-        # If the package does not exist in the release file, we have to
-        # add it.
-        if not updated:
-            newpkg = {}
-            newpkg['project'] = project
-            newpkg[tag_type] = {tag: package[tag_type][tag]}
-            tags_info['packages'].append(newpkg)
-        tags_info['packages'].sort(key=lambda i: i['project'])
-        with open(tags_file, 'w') as outfile:
-            yaml.dump(tags_info, stream=outfile)
+    update = TagsUpdate(info_files=info_files, local_dir=local_dir)
+    update.add(tag_type, project, tag_key, tag_value,
+               tags_filename=tags_filename,
+               update_all_files=update_all_files)
+    update.apply()
 
 
 def get_projects_distgit(tag=None, buildsys_tag=None):
-    re_distgit = re.compile('.*?((puppet|openstack)/.*).git')
+    index = get_index(info_files='rdo-full.yml')
     projects = get_projects(info_files='rdo-full.yml', tag=tag,
                             buildsys_tag=buildsys_tag)
     distgits = []
     for project in projects:
-        distgit_url = project['review-origin']
-        # For some packages as dependencies, review-origin is None
-        if distgit_url:
-            distgit_short = re.search(re_distgit, distgit_url).group(1)
+        distgit_short = index.get_distgit(project)
+        if distgit_short:
             distgits.append(distgit_short)
     return distgits
 
 
 def get_pin(package, release, local_dir=local_info):
-    distroinfo = info.DistroInfo(
-        info_files='rdo.yml',
-        local_info=local_dir)
-    inforepo = distroinfo.get_info()
-    pkgs = [p for p in inforepo['packages'] if p['name'] == package]
+    index = get_index(info_files='rdo.yml', local_dir=local_dir)
+    pkgs = index.get_by_name(package)
     if not pkgs or len(pkgs) != 1:
         raise NotInRdoinfo("Package %s not found in rdoinfo" % package)
     pkg = pkgs[0]
@@ -165,7 +453,7 @@ def get_new_pinned_builds(location, release):
     distroinfo = info.DistroInfo(
         info_files='rdo.yml',
         local_info=location)
-    info2 = distroinfo.get_info()
+    info2 = get_inforepo(info_files='rdo.yml', local_dir=location)
     with helpers.cdir(location):
         with git.git_revision('HEAD~'):
             info1 = distroinfo.get_info()
@@ -1,30 +1,162 @@
 import json
+import os
 import re
 import requests
+import subprocess
 import yaml
 
+from concurrent.futures import ThreadPoolExecutor
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
 
 
-def get_release_file(commit, path):
-    retry_strategy = Retry(
-        total=3,
-        status_forcelist=[404, 429, 500, 502, 503, 504],
-        method_whitelist=["GET"],
-        backoff_factor=2,
-    )
-    adapter = HTTPAdapter(max_retries=retry_strategy)
-    http = requests.Session()
-    http.mount("https://", adapter)
-    http.mount("http://", adapter)
+RELEASES_REPO = 'https://opendev.org/openstack/releases'
+# Number of concurrent requests when fetching release files
+FETCH_WORKERS = 8
+
+http_session = None
+releases_mirror = None
+
+
+class ReleasesMirror(object):
+    """ Local bare clone of openstack/releases used to read deliverable
+    files instead of downloading them from opendev.
+    """
+
+    def __init__(self, path, url=RELEASES_REPO):
+        self.path = path
+        self.url = url
+        self.fetched = False
+
+    def _git(self, *args, **kwargs):
+        return subprocess.run(['git', '--git-dir', self.path] + list(args),
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                              check=True, **kwargs)
+
+    def update(self):
+        """ Clone the repository or fetch new commits if it exists """
+        if not os.path.exists(self.path):
+            subprocess.run(['git', 'clone', '--mirror', '--quiet', self.url,
+                            self.path], check=True)
+        else:
+            self._git('remote', 'update', '--prune')
+        self.fetched = True
+
+    def has_commit(self, commit):
+        try:
+            self._git('cat-file', '-e', '%s^{commit}' % commit)
+            return True
+        except subprocess.CalledProcessError:
+            return False
+
+    def ensure_commits(self, commits):
+        """ Make sure commits are available locally, fetching the mirror
+        only once per run and the specific commits if they are still
+        missing (i.e. revisions of not merged reviews).
+        """
+        missing = [c for c in set(commits) if not self.has_commit(c)]
+        if missing and not self.fetched:
+            self.update()
+            missing = [c for c in missing if not self.has_commit(c)]
+        if missing:
+            self._git('fetch', '--quiet', self.url, *missing)
+
+    def read_files(self, commit_paths):
+        """ Read a list of (commit, path) files with a single git cat-file
+        process. Returns the contents in the same order, None for the files
+        not existing in the commit.
+        """
+        if not commit_paths:
+            return []
+        self.ensure_commits([c for c, _ in commit_paths])
+        batch = ''.join('%s:%s\n' % (c, p) for c, p in commit_paths)
+        output = self._git('cat-file', '--batch',
+                           input=batch.encode('utf-8')).stdout
+        contents = []
+        pos = 0
+        for _ in commit_paths:
+            end = output.index(b'\n', pos)
+            header = output[pos:end].split()
+            pos = end + 1
+            if len(header) != 3:
+                # "<object> missing" or "<object> ambiguous"
+                contents.append(None)
+                continue
+            size = int(header[2])
+            contents.append(output[pos:pos + size].decode('utf-8'))
+            pos += size + 1
+        return contents
+
+
+def set_releases_mirror(path, url=RELEASES_REPO):
+    """ Read release files from a local mirror in path instead of opendev.
+    The mirror is cloned if it does not exist.
+    """
+    global releases_mirror
+    if path is None:
+        releases_mirror = None
+    else:
+        releases_mirror = ReleasesMirror(path, url=url)
+
+
+def get_http_session():
+    """ Return a requests session shared by all release files requests, so
+    connections to opendev are reused.
+    """
+    global http_session
+    if http_session is None:
+        retry_strategy = Retry(
+            total=3,
+            status_forcelist=[404, 429, 500, 502, 503, 504],
+            method_whitelist=["GET"],
+            backoff_factor=2,
+        )
+        adapter = HTTPAdapter(max_retries=retry_strategy,
+                              pool_maxsize=FETCH_WORKERS)
+        http_session = requests.Session()
+        http_session.mount("https://", adapter)
+        http_session.mount("http://", adapter)
+    return http_session
+
+
+def get_release_file(commit, path, missing_ok=False):
+    """ Return the content of a file in openstack/releases in a commit. If
+    missing_ok is True, returns None instead of failing when the file does
+    not exist in the commit.
+    """
+    if releases_mirror is not None:
+        return get_release_files([(commit, path, missing_ok)])[0]
+    http = get_http_session()
     url = ("https://opendev.org/openstack/releases/raw/commit/%s/%s" %
            (commit, path))
-    release = http.get(url)
+    try:
+        release = http.get(url)
+    except requests.exceptions.RetryError:
+        # 404 is retried, so missing files end with RetryError
+        if missing_ok:
+            return None
+        raise
     if release.status_code == 200:
         return release.text
 
 
+def get_release_files(files, workers=FETCH_WORKERS):
+    """ Fetch a list of files concurrently. Each item is a tuple with the
+    arguments for get_release_file, i.e. (commit, path) or
+    (commit, path, missing_ok). Returns the contents in the same order.
+    """
+    if releases_mirror is not None:
+        contents = releases_mirror.read_files([f[:2] for f in files])
+        for f, content in zip(files, contents):
+            missing_ok = len(f) > 2 and f[2]
+            if content is None and not missing_ok:
+                raise ReleaseFileNotFound("File %s not found in commit %s" %
+                                          (f[1], f[0]))
+        return contents
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda f: get_release_file(*f), files))
+
+
 def get_release_info(release_content):
     deliverable = yaml.safe_load(release_content)
     if 'releases' not in deliverable.keys():
@@ -49,13 +181,22 @@ def get_new_releases_review(review):
     cur_rev_info = review['revisions'][cur_rev]
     parent_rev = cur_rev_info['commit']['parents'][0]['commit']
     files = cur_rev_info['files']
+    re_release = re.compile('deliverables/(.*)/.*')
+    mod_files = []
     for mod_file in files.keys():
-        re_release = re.compile('deliverables/(.*)/.*')
-        release = re.search(re_release, mod_file).group(1)
         file_def = files[mod_file]
         if 'status' in file_def.keys() and file_def['status'] == 'D':
             continue
-        new_release_f = get_release_file(cur_rev, mod_file)
+        mod_files.append(mod_file)
+    # Fetch the new and parent versions of all files at once
+    contents = get_release_files(
+        [(cur_rev, f) for f in mod_files] +
+        [(parent_rev, f, True) for f in mod_files])
+    new_files = contents[:len(mod_files)]
+    parent_files = contents[len(mod_files):]
+    for mod_file, new_release_f, parent_release_f in zip(mod_files, new_files,
+                                                         parent_files):
+        release = re.search(re_release, mod_file).group(1)
         new_release = get_release_info(new_release_f)
         if not new_release:
             continue
@@ -63,7 +204,6 @@ def get_new_releases_review(review):
         if re.search(re_excludes, new_release['version']):
             continue
         new_release['release'] = release
-        parent_release_f = get_release_file(parent_rev, mod_file)
         if parent_release_f is None:
             new_releases.append(new_release)
         else:
@@ -104,3 +244,7 @@ def get_files_release(release, user, password, only_branched=False):
             files = files + files_page
             page += 1
         return files
+
+
+class ReleaseFileNotFound(Exception):
+    pass
@@ -1,5 +1,6 @@
 
 import requests
+import time
 import validators
 
 from pygerrit2 import GerritRestAPI
@@ -16,9 +17,58 @@ GERRIT_URLS = {
 }
 
 QUERY_PARMS = "&o=CURRENT_REVISION&o=ALL_FILES&o=CURRENT_COMMIT"
-
-
-def get_gerrit_client(url, user=None, password=None):
+# Number of changes or projects requested per query
+PAGE_SIZE = 100
+
+# Gerrit clients by (url, user, password, cache_ttl)
+all_clients = {}
+
+
+class CachedGerritRestAPI(GerritRestAPI):
+    """ GerritRestAPI which keeps the results of GET requests for cache_ttl
+    seconds. Cached results are shared, callers must not modify them.
+    Caching is disabled when cache_ttl is 0.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.cache_ttl = kwargs.pop('cache_ttl', 0)
+        self.cache = {}
+        super(CachedGerritRestAPI, self).__init__(*args, **kwargs)
+
+    def get(self, endpoint, return_response=False, **kwargs):
+        if not self.cache_ttl or return_response or kwargs:
+            return super(CachedGerritRestAPI, self).get(
+                endpoint, return_response=return_response, **kwargs)
+        now = time.time()
+        try:
+            expires, result = self.cache[endpoint]
+            if expires > now:
+                return result
+        except KeyError:
+            pass
+        result = super(CachedGerritRestAPI, self).get(endpoint)
+        self.expire_cache(now)
+        self.cache[endpoint] = (now + self.cache_ttl, result)
+        return result
+
+    def expire_cache(self, now=None):
+        """ Remove the cached results which are expired """
+        if now is None:
+            now = time.time()
+        for endpoint in [endpoint for endpoint, (expires, _)
+                         in self.cache.items() if expires <= now]:
+            del self.cache[endpoint]
+
+    def clear_cache(self):
+        self.cache.clear()
+
+
+def get_gerrit_client(url, user=None, password=None, cache_ttl=None):
+    """ Return a Gerrit client for url. Clients are shared for the same
+    server, credentials and cache_ttl so connections are reused. If
+    cache_ttl is not None, the results of GET requests done by the client
+    are cached for cache_ttl seconds.
+    """
     if url in GERRIT_URLS.keys():
         gerrit_url = GERRIT_URLS[url]
     elif validators.url(url):
@@ -26,19 +76,53 @@ def get_gerrit_client(url, user=None, password=None):
     else:
         msg = "The provided url is not valid."
         return ValueError(msg)
-    if user and password:
-        return GerritRestAPI(url=gerrit_url,
-                             auth=HTTPBasicAuth(user, password),
-                             verify=False)
-    else:
-        return GerritRestAPI(url=gerrit_url, verify=False)
-
-
-def get_osp_releases_reviews(release,
-                             number=None,
-                             after=None,
-                             status='merged'):
-    client = get_gerrit_client('osp')
+    if not (user and password):
+        user = password = None
+    cache_ttl = cache_ttl or 0
+    key = (gerrit_url, user, password, cache_ttl)
+    client = all_clients.get(key)
+    if client is None:
+        if user and password:
+            client = CachedGerritRestAPI(url=gerrit_url,
+                                         auth=HTTPBasicAuth(user, password),
+                                         verify=False, cache_ttl=cache_ttl)
+        else:
+            client = CachedGerritRestAPI(url=gerrit_url, verify=False,
+                                         cache_ttl=cache_ttl)
+        all_clients[key] = client
+    return client
+
+
+def iter_changes(client, url, page_size=PAGE_SIZE):
+    """ Yield the changes returned by a /changes/ query, requesting them in
+    pages of page_size changes until Gerrit reports there are no more.
+    """
+    start = 0
+    while True:
+        changes = client.get("%s&n=%s&S=%s" % (url, page_size, start))
+        for change in changes:
+            yield change
+        if not changes or not changes[-1].get('_more_changes'):
+            return
+        start += len(changes)
+
+
+def iter_projects(client, url, page_size=PAGE_SIZE):
+    """ Yield (name, project_info) tuples for a /projects/ query, requesting
+    them in pages of page_size projects until a page is not full.
+    """
+    start = 0
+    while True:
+        projects = client.get("%s&n=%s&S=%s" % (url, page_size, start))
+        for name, project in projects.items():
+            yield name, project
+        if len(projects) < page_size:
+            return
+        start += len(projects)
+
+
+def _osp_releases_reviews_url(release, number=None, after=None,
+                              status='merged'):
     rev_url = "/changes/?q="
     if number:
         rev_url = "%s%s+" % (rev_url, number)
@@ -48,7 +132,25 @@ def get_osp_releases_reviews(release,
         rev_url = "%safter:%s+" % (rev_url, after)
     rev_url = ("%sproject:openstack/releases+file:deliverables+file:%s%s" %
                (rev_url, release, QUERY_PARMS))
-    reviews = client.get(rev_url)
+    return rev_url
+
+
+def iter_osp_releases_reviews(release,
+                              number=None,
+                              after=None,
+                              status='merged'):
+    client = get_gerrit_client('osp')
+    rev_url = _osp_releases_reviews_url(release, number=number, after=after,
+                                        status=status)
+    return iter_changes(client, rev_url)
+
+
+def get_osp_releases_reviews(release,
+                             number=None,
+                             after=None,
+                             status='merged'):
+    reviews = list(iter_osp_releases_reviews(release, number=number,
+                                             after=after, status=status))
     return (reviews)
 
 
@@ -58,18 +160,34 @@ def get_review(review):
     return (review)
 
 
-def get_reviews_project(client, project, **kwargs):
+def _reviews_project_url(project, **kwargs):
     url = "/changes/?q=project:\"^.*%s.*\"" % project
     for key, value in kwargs.items():
         if value:
             url = "%s+%s:%s" % (url, key, value)
-    return client.get(url)
+    return url
 
 
-def get_rdo_projects(client, **kwargs):
+def iter_reviews_project(client, project, **kwargs):
+    return iter_changes(client, _reviews_project_url(project, **kwargs))
+
+
+def get_reviews_project(client, project, **kwargs):
+    return list(iter_reviews_project(client, project, **kwargs))
+
+
+def _rdo_projects_url(**kwargs):
     url = '/projects/?r=(puppet|openstack)%2F.*distgit'
     for key, value in kwargs.items():
         if value:
             url = "%s&%s=%s" % (url, key, value)
-    projects = client.get(url)
+    return url
+
+
+def iter_rdo_projects(client, **kwargs):
+    return iter_projects(client, _rdo_projects_url(**kwargs))
+
+
+def get_rdo_projects(client, **kwargs):
+    projects = dict(iter_rdo_projects(client, **kwargs))
     return projects
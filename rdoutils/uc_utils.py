@@ -0,0 +1,156 @@
+import re
+import requests
+import sys
+
+from rdoutils import cache_utils
+
+UC_URL = ('https://opendev.org/openstack/requirements/raw/branch/{}/'
+          'upper-constraints.txt')
+
+# Directory used to keep downloaded upper-constraints files
+cache_dir = cache_utils.get_cache_dir('uc')
+
+# Exceptions for rdoinfo project name != project in upper-constraints
+UC_EXCEPTIONS = {
+    "glance_store": "glance-store",
+}
+
+re_marker = re.compile(r'^\s*(python_version|sys_platform)\s*'
+                       r'(===|==|!=|<=|>=|<|>)\s*[\'"]([^\'"]*)[\'"]\s*$')
+
+
+def uc_branch(release):
+    if release == 'master':
+        return release
+    return 'stable/{}'.format(release)
+
+
+def get_uc(branch, offline=False, url=UC_URL):
+    """ Return the content of upper-constraints.txt for a requirements
+    branch, i.e. master or stable/epoxy.
+
+    The file is kept in cache_dir with its ETag and Last-Modified headers
+    and only downloaded again when modified. If it can't be downloaded or
+    offline is True, the cached file is used.
+    """
+    uc_url = url.format(branch)
+    if offline:
+        content, _ = cache_utils.read_cached(uc_url, cache_dir)
+        if content is None:
+            raise UpperConstraintsUnavailable(
+                "No cached upper-constraints for %s" % uc_url)
+        return content
+
+    try:
+        status, content = cache_utils.cached_download(uc_url, cache_dir)
+    except requests.exceptions.RequestException as e:
+        status, content = None, None
+        error = e
+    if content is not None:
+        return content
+    if status == 404:
+        raise UpperConstraintsNotFound(
+            "The upper-constraints file does not exist in branch %s" %
+            branch)
+    content, _ = cache_utils.read_cached(uc_url, cache_dir)
+    if content is None:
+        msg = "Could not download upper-constraints file from %s" % uc_url
+        if status is None:
+            msg = "%s: %s" % (msg, error)
+        raise UpperConstraintsUnavailable(msg)
+    print("Could not download %s, using cached file" % uc_url,
+          file=sys.stderr)
+    return content
+
+
+def _version_tuple(version):
+    return tuple(int(v) for v in re.findall(r'\d+', version))
+
+
+def _marker_matches(marker, python_version=None, sys_platform='linux'):
+    """ Evaluate an environment marker in upper-constraints. Only
+    python_version and sys_platform comparisons joined with 'and' are
+    supported, anything else is considered a match. python_version is
+    not evaluated if None.
+    """
+    for condition in marker.split(' and '):
+        m = re_marker.match(condition)
+        if not m:
+            continue
+        variable, operator, value = m.groups()
+        if variable == 'python_version':
+            if python_version is None:
+                continue
+            current, value = (_version_tuple(python_version),
+                              _version_tuple(value))
+        else:
+            current = sys_platform
+        if operator in ('==', '==='):
+            matches = current == value
+        elif operator == '!=':
+            matches = current != value
+        elif operator == '<':
+            matches = current < value
+        elif operator == '<=':
+            matches = current <= value
+        elif operator == '>':
+            matches = current > value
+        else:
+            matches = current >= value
+        if not matches:
+            return False
+    return True
+
+
+def parse_uc(content, python_version=None):
+    """ Parse upper-constraints content. Returns a dictionary
+    (module_name, module_version), skipping the lines whose environment
+    markers do not match python_version. If python_version is None,
+    markers on python_version are ignored and the last entry of a module
+    is used.
+    """
+    uc = {}
+    for line in content.splitlines():
+        line = line.split('#')[0].strip()
+        if '===' not in line:
+            continue
+        name, version_spec = line.split('===', 1)
+        version, _, marker = version_spec.partition(';')
+        name, version = name.strip(), version.strip()
+        if not name or not version:
+            continue
+        if marker and not _marker_matches(marker,
+                                          python_version=python_version):
+            continue
+        uc[name] = version
+    return uc
+
+
+def load_uc(release, python_version=None, offline=False, url=UC_URL):
+    """ Download, or get from the cache, and parse upper-constraints for a
+    release. Returns a dictionary (module_name, module_version).
+    """
+    content = get_uc(uc_branch(release), offline=offline, url=url)
+    return parse_uc(content, python_version=python_version)
+
+
+def rdoinfo_name(module_name):
+    """ Return the name used in rdoinfo for a module in upper-constraints,
+    i.e. python-foo.bar -> foo-bar
+    """
+    if module_name.startswith('python-'):
+        module_name = module_name[7:]
+    return module_name.replace('.', '-')
+
+
+def uc_name(project):
+    """ Return the name in upper-constraints for a rdoinfo project """
+    return UC_EXCEPTIONS.get(project, project)
+
+
+class UpperConstraintsNotFound(Exception):
+    pass
+
+
+class UpperConstraintsUnavailable(Exception):
+    pass
@@ -47,12 +47,8 @@ pip install distroinfo >/dev/null
 pip install git+https://github.com/rdo-infra/releng >/dev/null
 echo -e "Creating of virtualenv OK"
 
-grep ^puppet $VERSIONS_FILE |awk -F, '{print $1 " "$2 "  " $3}'|while read pkg repo commit
-do
-    if [ $(echo $repo|grep -c opendev) -eq 0 ]; then
-        python $DIRNAME/update-tag.py $RDOINFO_DIR $MASTER_RELEASE-uc $pkg $commit $MODE
-    fi
-done
+grep ^puppet $VERSIONS_FILE |awk -F, '$2 !~ /opendev/ {print $1 " " $3}' | \
+    python $DIRNAME/update-tag.py $RDOINFO_DIR $MASTER_RELEASE-uc - $MODE
 deactivate
 
 pushd $RDOINFO_DIR >/dev/null 2>&1
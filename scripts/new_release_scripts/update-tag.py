@@ -1,21 +1,45 @@
 import sys
 from rdoutils import rdoinfo
 
-if len(sys.argv) not in [5, 6]:
-    print("usage: update-tag.py <rdoinfo location> <tag> <package> \
-          <source-branch value>")
+USAGE = """usage: update-tag.py <rdoinfo location> <tag> <package> \
+<source-branch value> [pin|unset]
+       update-tag.py <rdoinfo location> <tag> - [pin|unset]
+
+When package is '-', lines '<package> <source-branch value>' (or only
+'<package>' in unset mode) are read from stdin and all of them are
+updated at once."""
+
+if len(sys.argv) not in [4, 5, 6] or \
+        (len(sys.argv) == 4 and sys.argv[3] != '-'):
+    print(USAGE)
     sys.exit(1)
 
 RDOINFO_DIR = sys.argv[1]
 TAG = sys.argv[2]
 PACKAGE = sys.argv[3]
-PIN = sys.argv[4]
-MODE = sys.argv[5] or "pin"
-
-if MODE == "pin":
-    print("Updating tag: %s for project: %s to %s" % (TAG, PACKAGE, PIN))
-    rdoinfo.update_tag('tags', PACKAGE, TAG, {'source-branch': PIN},
-                       local_dir=RDOINFO_DIR)
+if PACKAGE == '-':
+    MODE = sys.argv[4] if len(sys.argv) > 4 else "pin"
+    PINS = [line.split() for line in sys.stdin if line.strip()]
 else:
-    print("Unsetting tag: %s for project: %s" % (TAG, PACKAGE))
-    rdoinfo.update_tag('tags', PACKAGE, TAG, None, local_dir=RDOINFO_DIR)
+    MODE = sys.argv[5] if len(sys.argv) > 5 else "pin"
+    PINS = [[PACKAGE, sys.argv[4]]]
+
+ERRORS = 0
+with rdoinfo.TagsUpdate(local_dir=RDOINFO_DIR, atomic=True) as update:
+    for pin in PINS:
+        if MODE == "pin":
+            if len(pin) != 2:
+                print("Skipping invalid line, expected '<package> "
+                      "<source-branch value>': %s" % ' '.join(pin),
+                      file=sys.stderr)
+                ERRORS += 1
+                continue
+            print("Updating tag: %s for project: %s to %s" %
+                  (TAG, pin[0], pin[1]))
+            update.add('tags', pin[0], TAG, {'source-branch': pin[1]})
+        else:
+            print("Unsetting tag: %s for project: %s" % (TAG, pin[0]))
+            update.add('tags', pin[0], TAG, None)
+
+if ERRORS:
+    sys.exit(1)
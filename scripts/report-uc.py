@@ -1,16 +1,24 @@
 #!/usr/bin/python3
 import argparse
+import csv
 import dnf
+import fcntl
+import hashlib
+import json
 import koji
+import multiprocessing
 import os
 import pymod2pkg
 import random
 import requests
 import rpm
 import sys
+import time
 import yaml
 
-from re import search
+from contextlib import contextmanager
+from rdoutils import cbs_utils
+from rdoutils import uc_utils
 
 if sys.version_info[0] == 3:
     from tempfile import TemporaryDirectory
@@ -31,7 +39,19 @@ UC = ('https://raw.githubusercontent.com/openstack/requirements/{}/'
       'upper-constraints.txt')
 
 pkgs_base = None
+provides_index = None
 tag_builds = {}
+# Seconds spent in each phase of the report
+timings = {}
+
+
+@contextmanager
+def timed(phase):
+    start = time.time()
+    try:
+        yield
+    finally:
+        timings[phase] = timings.get(phase, 0) + time.time() - start
 
 
 class UpperConstraint(object):
@@ -65,6 +85,15 @@ class UpperConstraint(object):
     def __str__(self):
         return ','.join(self.to_list())
 
+    def to_dict(self):
+        return {'module_name': self.module_name,
+                'module_version': self.module_version,
+                'pkg_name': self.pkg_name,
+                'pkg_version': self.pkg_version,
+                'source': self.source,
+                'status': self.status,
+                'overridden_repos': self.overridden_repos}
+
     def to_list(self):
         if self.show_overridden_repos:
             return [self.release, self.module_name, self.module_version,
@@ -77,34 +106,21 @@ class UpperConstraint(object):
 
 def load_uc(release, distro):
     """
-    Load upper-constraints file directly from Github mirror.
+    Load upper-constraints file from Github mirror, or from the local cache
+    if it was not modified.
     Returns a dictionary with a dictionary (module_name, module_version).
     """
-    uc = {}
-    if release != 'master':
-        branch = 'stable/{}'.format(release)
-    else:
-        branch = release
-    url = UC.format(branch)
-    uc_file = requests.get(url)
-    if uc_file.status_code == 404:
+    try:
+        return uc_utils.load_uc(release,
+                                python_version=DEFAULT_PY_VERS[distro],
+                                url=UC)
+    except uc_utils.UpperConstraintsNotFound:
         print('The Openstack release "{}" does not exist.'.format(release))
         sys.exit(1)
-    elif uc_file.status_code != 200:
-        print('Could not download upper-constraints file from {}'.format(url))
+    except uc_utils.UpperConstraintsUnavailable as e:
+        print(e)
         sys.exit(1)
 
-    for line in uc_file.text.split('\n'):
-        m = search(r'^(.*)===([\d\.]+)(;python_version==\'(.*)\')?', line)
-        if not m:
-            continue
-        name, version, py_vers = m.group(1), m.group(2), m.group(4)
-        # we skip it if the python_version does not match the distro's one
-        if py_vers is not None and py_vers != DEFAULT_PY_VERS[distro]:
-            continue
-        uc[name] = version
-    return uc
-
 
 def is_url(url):
     try:
@@ -211,6 +227,19 @@ def add_repos_to_base(base, repo):
         base.repos.add_new_repo(repo_id, base.conf, baseurl=[base_url])
 
 
+@contextmanager
+def repo_lock(repo):
+    """
+    Lock the metadata of a repo in DNF_CACHEDIR, based on its id and urls.
+    """
+    urls = str((list(repo.baseurl), repo.metalink, repo.mirrorlist))
+    lock_file = os.path.join(DNF_CACHEDIR, '{}-{}.lock'.format(
+        repo.id, hashlib.sha1(urls.encode('utf-8')).hexdigest()[:16]))
+    with open(lock_file, 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+
 def download_repos_metadata(repo_url, repo, repos_dir, distro):
     """
     Load information about packages from the enabled repositories into
@@ -219,12 +248,47 @@ def download_repos_metadata(repo_url, repo, repos_dir, distro):
     global pkgs_base
     if pkgs_base:
         return pkgs_base
-    pkgs_base = dnf_base(distro, repos_dir)
-    add_repos_to_base(pkgs_base, repo)
-    local_repo_url_files = add_repo_from_url_in_repos_dir(repo_url, repos_dir)
-    pkgs_base.read_all_repos()
-    remove_files(local_repo_url_files)
-    pkgs_base.fill_sack(load_system_repo=False)
+    with timed('metadata'):
+        pkgs_base = dnf_base(distro, repos_dir)
+        add_repos_to_base(pkgs_base, repo)
+        local_repo_url_files = add_repo_from_url_in_repos_dir(repo_url,
+                                                              repos_dir)
+        pkgs_base.read_all_repos()
+        remove_files(local_repo_url_files)
+        for _repo in pkgs_base.repos.iter_enabled():
+            # Processes sharing DNF_CACHEDIR download the metadata of a
+            # repo one at a time, the first one downloads it and the others
+            # reuse it
+            with repo_lock(_repo):
+                try:
+                    _repo.load()
+                except dnf.exceptions.RepoError:
+                    # Reported by fill_sack
+                    pass
+        pkgs_base.fill_sack(load_system_repo=False)
+
+
+def build_provides_index(names):
+    """
+    Index the packages in the sack providing any of the names passed as
+    argument, i.e. python3dist(foo), with a single query.
+    Returns a dictionary (provide name, [packages]).
+    """
+    global provides_index
+    if provides_index is None:
+        provides_index = {}
+    names = set(names) - set(provides_index)
+    if not names:
+        return provides_index
+    with timed('index'):
+        for name in names:
+            provides_index[name] = []
+        for _p in pkgs_base.sack.query().filter(provides=list(names)):
+            for _prov in _p.provides:
+                name = str(_prov).split()[0]
+                if name in names and _p not in provides_index[name]:
+                    provides_index[name].append(_p)
+    return provides_index
 
 
 def repoquery(*args, **kwargs):
@@ -233,28 +297,49 @@ def repoquery(*args, **kwargs):
     Only supports --provides and --all.
     """
     if 'provides' in kwargs:
+        providers = build_provides_index([kwargs['provides']])[
+            kwargs['provides']]
         if 'latest' in kwargs and kwargs['latest'] is True:
-            return pkgs_base.sack.query().filter(provides=kwargs['provides']).\
-                latest().run()
+            return latest_packages(providers)
         else:
-            return pkgs_base.sack.query().filter(provides=kwargs['provides']).\
-                run()
+            return list(providers)
     if 'all' in kwargs and kwargs['all']:
         return pkgs_base.sack.query()
     raise RuntimeError('unknown query')
 
 
+def latest_packages(packages):
+    """
+    Return the packages with the highest EVR for each name and arch, as
+    hawkey query latest().
+    """
+    latest = {}
+    for _p in packages:
+        key = (_p.name, _p.arch)
+        if key not in latest or _p.evr_cmp(latest[key]) > 0:
+            latest[key] = _p
+    return [_p for _p in packages
+            if _p.evr_cmp(latest[(_p.name, _p.arch)]) == 0]
+
+
 def get_all_repos_providing_pkg(pkg_name):
     """
     Get all repositories in the sack providing the package.
     Return a list of repo names.
     """
-    repos = list()
-    provides = repoquery(provides=pkg_name)
-    for _p in provides:
-        if _p.reponame not in repos:
-            repos.append(_p.reponame)
-    return repos
+    repos = dict()
+    for _p in repoquery(provides=pkg_name):
+        repos[_p.reponame] = True
+    return list(repos)
+
+
+def provide_name(mod_name, distro):
+    """
+    Return the name provided by the package of a module.
+    """
+    if int(distro[-1]) > 7:
+        return "python3dist({})".format(mod_name.lower())
+    return pymod2pkg.module2package(mod_name, 'fedora')
 
 
 def get_packages_provided_by_repos(mod_name, mod_version, provided_uc,
@@ -265,16 +350,14 @@ def get_packages_provided_by_repos(mod_name, mod_version, provided_uc,
     For distro with releasever > 7, we take advantage of the Python
     dependency generator (e.g python3dist(foo)) which returns the package name.
     Else, we use pymod2pkg to get package names.
-    After, the repoquery command execution, we append the global list with the
-    result.
+    Both the latest provider and the other repos providing the module are
+    found in the provides index.
     """
-    if int(distro[-1]) > 7:
-        pkg_name = "python3dist({})".format(mod_name.lower())
-    else:
-        pkg_name = pymod2pkg.module2package(mod_name, 'fedora')
+    pkg_name = provide_name(mod_name, distro)
     download_repos_metadata(repo_url, repo, repos_dir, distro)
-    latest_pkg = repoquery(provides=pkg_name, latest=True)
-    all_repos_providing_pkg = get_all_repos_providing_pkg(pkg_name)
+    with timed('query'):
+        latest_pkg = repoquery(provides=pkg_name, latest=True)
+        all_repos_providing_pkg = get_all_repos_providing_pkg(pkg_name)
     try:
         pkg = latest_pkg.pop()
         all_repos_providing_pkg.remove(pkg.reponame)
@@ -301,7 +384,8 @@ def get_packages_provided_by_repos(mod_name, mod_version, provided_uc,
 
 def list_builds_from_tag(tag, koji_profile):
     """
-    Get builds from a Koji tag passed as argument.
+    Get builds from a Koji tag passed as argument, using the cached listing
+    of the tag refreshed since the last run.
     A Koji profile can also be passed as argument.
     Returns a dictionary (build name, (version, tag))
     """
@@ -313,7 +397,7 @@ def list_builds_from_tag(tag, koji_profile):
         sys.exit(1)
     client = koji_module.ClientSession(koji_module.config.server)
     try:
-        for _b in client.listTagged(tag):
+        for _b in cbs_utils.list_tagged(tag, client=client):
             builds[_b['name']] = {'version': _b['version'],
                                   'tag': _b['tag_name']}
     except Exception as e:
@@ -331,7 +415,8 @@ def get_builds_by_koji_tag(tag, mod_name, mod_version, provided_uc,
     try:
         builds = tag_builds[tag]
     except KeyError:
-        builds = list_builds_from_tag(tag, koji_profile)
+        with timed('koji'):
+            builds = list_builds_from_tag(tag, koji_profile)
     pkg_name = pymod2pkg.module2package(mod_name, 'fedora')
     try:
         builds[pkg_name]
@@ -355,7 +440,8 @@ def get_builds_by_koji_tag(tag, mod_name, mod_version, provided_uc,
 def provides_uc(release, distro, repo_url, repo, repos_dir, tag, koji_profile,
                 show_overridden_repos):
     provided_uc = []
-    uc = load_uc(release, distro)
+    with timed('upper-constraints'):
+        uc = load_uc(release, distro)
     if repos_dir is None:
         td = TemporaryDirectory()
         try:
@@ -363,6 +449,11 @@ def provides_uc(release, distro, repo_url, repo, repos_dir, tag, koji_profile,
         except AttributeError:
             repos_dir = td
 
+    if repo or repos_dir or repo_url:
+        # Index the providers of all the modules at once
+        download_repos_metadata(repo_url, repo, repos_dir, distro)
+        build_provides_index([provide_name(mod_name, distro)
+                              for mod_name in uc])
     for mod_name, mod_version in uc.items():
         if repo or repos_dir or repo_url:
             get_packages_provided_by_repos(mod_name, mod_version, provided_uc,
@@ -400,6 +491,12 @@ def print_source_informations(nbr_of_matches_from_source):
     print("\nEnabled repositories/tag:\n{}".format(yaml.safe_dump(sources)))
 
 
+def print_timings():
+    """Print the time spent in each phase to stderr."""
+    for phase, seconds in sorted(timings.items()):
+        sys.stderr.write("{}: {:.2f}s\n".format(phase, seconds))
+
+
 def increment_counter(source, counter):
     """Increment the number of matches from a repo/tag source."""
     try:
@@ -419,14 +516,111 @@ def main(release, distro, repo_url, repo, repos_dir, tag, koji_profile,
                 increment_counter(uc.source, nbr_of_matches_from_source)
     if verbose:
         print_source_informations(nbr_of_matches_from_source)
+        print_timings()
+
+
+def format_batch_value(value, release, distro):
+    """Replace {release} and {distro} in a batch mode argument."""
+    return value.replace('{release}', release).replace('{distro}', distro)
+
+
+def batch_worker(batch_args):
+    """
+    Run the report for a release and distro in a worker process. Returns
+    a tuple (release, distro, [UpperConstraint.to_dict(), ...], error),
+    error being None if the report succeeded.
+    """
+    (release, distro, repo_url, repo, repos_dir, tag, koji_profile) = \
+        batch_args
+    try:
+        provided_uc = provides_uc(release, distro, repo_url, repo,
+                                  repos_dir, tag, koji_profile, True)
+    except SystemExit as e:
+        # The report functions exit on errors, which would leave the pool
+        # waiting for a result forever
+        return release, distro, None, 'exited with status {}'.format(e.code)
+    except Exception as e:
+        return release, distro, None, repr(e)
+    return release, distro, [uc.to_dict() for uc in provided_uc], None
+
+
+def main_batch(batch, repo_url, repo, repos_dir, tag, koji_profile, status,
+               jobs, output_format):
+    """
+    Run the report for several release:distro pairs, each one in its own
+    worker process with its own sack. All of them share DNF_CACHEDIR, so
+    metadata of repos used by several pairs is downloaded only once.
+    Exits as soon as one of the pairs fails.
+    Arguments can contain {release} and {distro}, replaced for each pair.
+    Prints a combined CSV with a row per module and pair or a JSON matrix
+    {module_name: {'release/distro': [result, ...]}}.
+    """
+    batch_args = []
+    for pair in batch:
+        try:
+            release, distro = pair.split(':')
+        except ValueError:
+            print('Invalid batch entry "{}", use release:distro'.format(pair))
+            sys.exit(1)
+        if distro not in DISTROS:
+            print('Unknown distro "{}"'.format(distro))
+            sys.exit(1)
+        batch_args.append((
+            release, distro,
+            [format_batch_value(_u, release, distro) for _u in repo_url],
+            [format_batch_value(_r, release, distro) for _r in repo],
+            repos_dir and format_batch_value(repos_dir, release, distro),
+            tag and format_batch_value(tag, release, distro),
+            koji_profile))
+
+    create_dir(DNF_CACHEDIR)
+    # A new process per pair, so each one starts with empty globals
+    pool = multiprocessing.Pool(jobs, maxtasksperchild=1)
+    results = {}
+    try:
+        for release, distro, provided_uc, error in pool.imap_unordered(
+                batch_worker, batch_args):
+            if error is not None:
+                print('Report for {}:{} failed: {}'.format(release, distro,
+                                                           error),
+                      file=sys.stderr)
+                sys.exit(1)
+            results[(release, distro)] = provided_uc
+    finally:
+        # Stop the workers still running if a pair failed
+        pool.terminate()
+        pool.join()
+
+    matrix = {}
+    rows = []
+    for release, distro, _, _, _, _, _ in batch_args:
+        provided_uc = results[(release, distro)]
+        for uc in provided_uc:
+            if status != '' and uc['status'] != status:
+                continue
+            key = '{}/{}'.format(release, distro)
+            matrix.setdefault(uc['module_name'], {}).setdefault(
+                key, []).append(uc)
+            rows.append([release, distro, uc['module_name'],
+                         uc['module_version'], uc['pkg_name'],
+                         uc['pkg_version'], uc['source'], uc['status'],
+                         uc['overridden_repos']])
+
+    if output_format == 'json':
+        print(json.dumps(matrix, indent=2, sort_keys=True))
+    else:
+        writer = csv.writer(sys.stdout)
+        writer.writerow(['release', 'distro', 'module_name',
+                         'module_version', 'pkg_name', 'pkg_version',
+                         'source', 'status', 'overridden_repos'])
+        writer.writerows(rows)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description=("Compare upper-constraints "
                                                   "with existing repos/tags."))
     parser.add_argument('-o', '--release',
-                        required=True,
-                        default=DEFAULT_RELEASE,
+                        default=None,
                         help=('openstack release (i.e. [{}], ussuri, train '
                               ', etc)'.format(DEFAULT_RELEASE)))
     parser.add_argument('-d', '--distro',
@@ -460,8 +654,26 @@ if __name__ == '__main__':
                         action='store_true',
                         default=False,
                         help='verbose mode')
+    parser.add_argument('-b', '--batch', action='append', default=[],
+                        help=('run the report for several release:distro '
+                              'pairs (i.e. master:centos9), can be used '
+                              'several times. {release} and {distro} are '
+                              'replaced in repos, repos dir and tag'))
+    parser.add_argument('-j', '--jobs', type=int, default=2,
+                        help='number of worker processes in batch mode')
+    parser.add_argument('-f', '--output-format',
+                        choices=['csv', 'json'], default='csv',
+                        help='output format in batch mode')
     args = parser.parse_args()
 
+    if args.batch:
+        main_batch(args.batch, args.repo_url, args.repo, args.repos_dir,
+                   args.tag, args.koji_profile, args.status, args.jobs,
+                   args.output_format)
+        sys.exit(0)
+    if args.release is None:
+        parser.error('the following arguments are required: -o/--release')
+
     main(args.release, args.distro, args.repo_url, args.repo, args.repos_dir,
          args.tag, args.koji_profile, args.status, args.verbose,
          args.show_overridden_repos)